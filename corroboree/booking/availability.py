@@ -0,0 +1,175 @@
+import uuid
+from datetime import date, datetime, timedelta
+
+from django.core.cache import cache
+from django.db.models import Min
+from django.utils import timezone
+
+from corroboree.booking.models import BookingRecord, live_room_nights
+from corroboree.booking.pricing import PricingTables, pricing_tables
+from corroboree.config import models as config
+
+GENERATION_KEY = 'availability:generation'
+SNAPSHOT_KEY = 'availability:snapshot'
+SNAPSHOT_LOCK_KEY = 'availability:snapshot:lock'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def room_bit(room_number: int) -> int:
+    """The bit representing a room in an availability bitmask"""
+    return 1 << room_number
+
+
+class RoomAvailability:
+    """Free rooms for each day in [first_day, last_day) stored as one integer bitmask per day.
+
+    Built from a single pass over the live bookings in the window so no per-day querysets are needed."""
+
+    def __init__(self, first_day: date, last_day: date, rooms: [config.Room], occupied: [int]):
+        self.first_day = first_day
+        self.last_day = last_day
+        self.rooms = rooms
+        self.occupied = occupied
+        self.all_rooms_mask = 0
+        for room in rooms:
+            self.all_rooms_mask |= room_bit(room.room_number)
+
+    def __len__(self):
+        return len(self.occupied)
+
+    def days(self):
+        for offset in range(len(self.occupied)):
+            yield self.first_day + timedelta(days=offset)
+
+    def free_mask(self, day: date) -> int:
+        return self.all_rooms_mask & ~self.occupied[(day - self.first_day).days]
+
+    def free_rooms(self, day: date) -> [config.Room]:
+        mask = self.free_mask(day)
+        return [r for r in self.rooms if mask & room_bit(r.room_number)]
+
+    def free_in_range(self, arrival_date: date, departure_date: date) -> int:
+        """Bitmask of rooms free for every night from arrival_date up to departure_date"""
+        mask = self.all_rooms_mask
+        start = max(0, (arrival_date - self.first_day).days)
+        end = min(len(self.occupied), (departure_date - self.first_day).days)
+        for offset in range(start, end):
+            mask &= ~self.occupied[offset]
+        return mask
+
+    def as_dict(self) -> dict:
+        """The calendar API representation: {'YYYY-MM-DD': ['room str', ...]}"""
+        labels = [(room_bit(r.room_number), str(r)) for r in self.rooms]
+        data = {}
+        for offset, occupied in enumerate(self.occupied):
+            free = self.all_rooms_mask & ~occupied
+            day = self.first_day + timedelta(days=offset)
+            data[day.strftime('%Y-%m-%d')] = [label for bit, label in labels if free & bit]
+        return data
+
+
+def room_availability(first_day: date, last_day: date) -> RoomAvailability:
+    """Compute free rooms per day for [first_day, last_day) in one query.
+
+    Rooms come from the config snapshot and the query range scans the RoomNight table for nights held by live bookings
+    in the window. Occupancy is then folded into per-day bitmasks in python."""
+    rooms = list(pricing_tables().rooms)
+    length = max(0, (last_day - first_day).days)
+    occupied = [0] * length
+    booked = live_room_nights(first_day, last_day).values_list('date', 'room_id')
+    for night, room_number in booked:
+        occupied[(night - first_day).days] |= room_bit(room_number)
+    return RoomAvailability(first_day, last_day, rooms, occupied)
+
+
+def booking_horizon(tables: PricingTables, today: date = None) -> (date, date):
+    """The first and last (exclusive) days a member could currently hold a room for"""
+    today = date.today() if today is None else today
+    return today, today + timedelta(weeks=tables.max_weeks_till_booking + 2)
+
+
+# Caching
+#
+# Cached availability is keyed on a generation token which is bumped whenever a booking changes in a way that could
+# free or occupy a room. Holds also expire without a write, so the earliest pending expiry is tracked and the
+# generation is bumped lazily the first time it is read after that instant.
+
+def next_hold_expiry():
+    """When the next live in progress or submitted booking stops holding its rooms, or None"""
+    return BookingRecord.live_objects.aggregate(next_expiry=Min('expires_at'))['next_expiry']
+
+
+def bump_availability_generation() -> (str, datetime):
+    """Invalidate all cached availability. Called whenever bookings change.
+
+    Generations are random tokens rather than a counter so an evicted generation can never be reissued."""
+    token, modified = uuid.uuid4().hex, timezone.now()
+    cache.set(GENERATION_KEY, (token, modified, next_hold_expiry()), timeout=None)
+    return token, modified
+
+
+def availability_generation() -> (str, datetime):
+    """The current generation token and when it last changed"""
+    state = cache.get(GENERATION_KEY)
+    if state is None:
+        return bump_availability_generation()
+    token, modified, next_expiry = state
+    if next_expiry is not None and next_expiry <= timezone.now():
+        return bump_availability_generation()
+    return token, modified
+
+
+def cached_availability_data(first_day: date, last_day: date, generation: str = None) -> dict:
+    """The calendar API data for a window, computed at most once per generation"""
+    if generation is None:
+        generation, _ = availability_generation()
+    key = 'availability:{generation}:{first}:{last}'.format(
+        generation=generation,
+        first=first_day.isoformat(),
+        last=last_day.isoformat(),
+    )
+    data = cache.get(key)
+    if data is None:
+        data = room_availability(first_day, last_day).as_dict()
+        cache.set(key, data, timeout=CACHE_TIMEOUT)
+    return data
+
+
+# Snapshots
+#
+# While a week is being released every reservation bumps the generation, so generation keyed data would be recomputed
+# on almost every calendar request. Instead one snapshot covering every window the calendar is likely to ask for is
+# retaken at most every few seconds by whichever worker notices it is old, and the others keep serving the previous
+# one meanwhile. Stale free rooms are harmless as reservations check availability again under row locks.
+
+def take_availability_snapshot(first_day: date, last_day: date) -> dict:
+    snapshot = {
+        'token': uuid.uuid4().hex,
+        'taken': timezone.now(),
+        'first_day': first_day,
+        'last_day': last_day,
+        'data': room_availability(first_day, last_day).as_dict(),
+    }
+    cache.set(SNAPSHOT_KEY, snapshot, timeout=CACHE_TIMEOUT)
+    return snapshot
+
+
+def snapshot_covers(snapshot: dict, first_day: date, last_day: date) -> bool:
+    return snapshot['first_day'] <= first_day and last_day <= snapshot['last_day']
+
+
+def availability_snapshot(first_day: date, last_day: date, max_age: timedelta) -> dict:
+    """A snapshot covering at least [first_day, last_day), retaken by one worker once it is older than max_age"""
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is None or not snapshot_covers(snapshot, first_day, last_day):
+        return take_availability_snapshot(first_day, last_day)
+    if snapshot['taken'] + max_age <= timezone.now() and cache.add(SNAPSHOT_LOCK_KEY, True, max_age.total_seconds()):
+        return take_availability_snapshot(first_day, last_day)
+    return snapshot
+
+
+def snapshot_data(snapshot: dict, first_day: date, last_day: date) -> dict:
+    """The calendar API data for a window inside a snapshot"""
+    data = snapshot['data']
+    days = ((first_day + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range((last_day - first_day).days))
+    return {day: data[day] for day in days}
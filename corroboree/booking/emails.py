@@ -0,0 +1,25 @@
+from functools import cache
+
+from django.template.loader import get_template
+
+HTML_TEMPLATE = 'email/confirmation_mail_template.html'
+TEXT_TEMPLATE = 'email/confirmation_mail_template.txt'
+
+
+@cache
+def booking_email_templates():
+    """The compiled plain text and html templates, loaded once per process"""
+    return get_template(TEXT_TEMPLATE), get_template(HTML_TEMPLATE)
+
+
+def named_attendees(booking) -> [dict]:
+    """The booking's guests who have been given a name and email"""
+    return [x for x in booking.other_attendees.values() if
+            x['first_name'] != '' and x['last_name'] != '' and x['email'] != '']
+
+
+def render_booking_email(booking, email_text: str) -> (str, str):
+    """The plain text and html bodies of an email about a booking"""
+    text_template, html_template = booking_email_templates()
+    context = {'booking': booking, 'email_text': email_text, 'attendees': named_attendees(booking)}
+    return text_template.render(context), html_template.render(context)
@@ -0,0 +1,50 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.dispatch import Signal
+from django.utils import timezone
+
+from corroboree.booking.availability import bump_availability_generation
+from corroboree.booking.models import BookingRecord, hold_expiry
+from corroboree.booking.occupancy import release_room_nights
+
+BATCH_SIZE = 500
+
+# Sent inside each batch's transaction, before its UPDATE, with the ids about to change and their new status.
+# bulk_update_status bypasses save() so this is the place for per-transition safeguards. A receiver raising leaves
+# that batch unchanged and stops the update.
+pre_bulk_status_update = Signal()
+
+
+def expired_holds(*statuses: BookingRecord.BookingRecordStatus) -> QuerySet[BookingRecord]:
+    """Bookings of in progress or submitted statuses whose hold on their rooms has run out"""
+    return BookingRecord.objects.filter(status__in=statuses, expires_at__lte=timezone.now())
+
+
+def bulk_update_status(bookings: QuerySet[BookingRecord], status: BookingRecord.BookingRecordStatus,
+                       batch_size: int = BATCH_SIZE) -> {str: int}:
+    """Move every booking in a queryset to status with one UPDATE per batch of ids, rather than a save() each.
+
+    Each batch locks and updates its rows in a short transaction of its own, or in the caller's if there is one, and
+    releases the RoomNights of cancelled bookings. Availability is invalidated once, when the changes are committed.
+    Returns how many bookings were moved from each status."""
+    updated = Counter()
+    while True:
+        with transaction.atomic():
+            rows = list(bookings.exclude(status=status).select_for_update().values_list('pk', 'status')[:batch_size])
+            if not rows:
+                break
+            ids = [pk for pk, _ in rows]
+            pre_bulk_status_update.send(sender=BookingRecord, booking_ids=ids, status=status)
+            BookingRecord.objects.filter(pk__in=ids).update(
+                status=status,
+                expires_at=hold_expiry(status, timezone.now()),
+            )
+            if status == BookingRecord.BookingRecordStatus.CANCELLED:
+                release_room_nights(ids)
+            updated.update(previous for _, previous in rows)
+    if updated:
+        # like the signal receivers, so nothing caches availability from before the caller's transaction commits
+        transaction.on_commit(bump_availability_generation)
+    return dict(updated)
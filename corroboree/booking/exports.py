@@ -0,0 +1,132 @@
+import csv
+import datetime
+import tempfile
+
+from django.db.models import Max, Prefetch, QuerySet, Sum
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+
+from corroboree.booking.models import BookingRecord
+from corroboree.config import models as config
+
+CHUNK_SIZE = 500
+GUEST_FIELDS = [('first_name', 'First Name'), ('last_name', 'Last Name'), ('email', 'Email')]
+
+# Booking exports
+#
+# The bookings admin's CSV and XLSX downloads are written here rather than by Wagtail, which loads the whole listing
+# into memory before writing it. Bookings are read CHUNK_SIZE at a time with their rooms prefetched per chunk and each
+# row is written as soon as it is read, so memory use doesn't grow with the number of bookings exported. CSV is
+# streamed to the browser as it is written, XLSX is written to a temporary file first since a workbook is only
+# complete once it is closed.
+
+def export_bookings(queryset: QuerySet[BookingRecord]) -> QuerySet[BookingRecord]:
+    return queryset.select_related('member', 'member_in_attendance').prefetch_related(
+        Prefetch('rooms', queryset=config.Room.objects.select_related('room_type'))
+    )
+
+
+def guest_columns(queryset: QuerySet[BookingRecord]) -> int:
+    """How many guests any of the bookings can have, i.e. the occupants of its rooms other than the member attending"""
+    capacity = queryset.order_by().annotate(
+        capacity=Sum('rooms__room_type__max_occupants')
+    ).aggregate(most=Max('capacity'))['most']
+    return max((capacity or 0) - 1, 0)
+
+
+def export_headings(guests: int) -> [str]:
+    headings = [
+        'Member',
+        'Member Name at Creation',
+        'Last Updated',
+        'Arrival Date',
+        'Departure Date',
+        'Member in Attendance',
+        'Member in Attendance Name at Creation',
+        'Status',
+        'Payment Status',
+        'Cost',
+        'PayPal Transaction ID',
+        'Rooms',
+    ]
+    for guest in range(1, guests + 1):
+        headings.extend('Guest {n} {label}'.format(n=guest, label=label) for _, label in GUEST_FIELDS)
+    headings.append('Other Guests')  # any beyond the guest columns, e.g. added by an administrator
+    return headings
+
+
+def export_row(booking: BookingRecord, guests: int) -> list:
+    row = [
+        str(booking.member),
+        booking.member_name_at_creation,
+        timezone.localtime(booking.last_updated).replace(tzinfo=None),
+        booking.arrival_date,
+        booking.departure_date,
+        '' if booking.member_in_attendance is None else str(booking.member_in_attendance),
+        booking.member_in_attendance_name_at_creation,
+        booking.get_status_display(),
+        booking.get_payment_status_display(),
+        booking.cost,
+        booking.paypal_transaction_id,
+        ', '.join(str(room) for room in booking.rooms.all()),
+    ]
+    attendees = [attendee for attendee in booking.other_attendees.values() if any(attendee.values())]
+    for guest in range(guests):
+        attendee = attendees[guest] if guest < len(attendees) else {}
+        row.extend(attendee.get(field, '') for field, _ in GUEST_FIELDS)
+    row.append('; '.join(guest_text(attendee) for attendee in attendees[guests:]))
+    return row
+
+
+def guest_text(attendee: dict) -> str:
+    return '{first_name} {last_name} <{email}>'.format(
+        first_name=attendee.get('first_name', ''),
+        last_name=attendee.get('last_name', ''),
+        email=attendee.get('email', ''),
+    )
+
+
+def export_rows(queryset: QuerySet[BookingRecord]):
+    """The heading row and then a row per booking, read a chunk at a time"""
+    guests = guest_columns(queryset)
+    yield export_headings(guests)
+    for booking in export_bookings(queryset).iterator(chunk_size=CHUNK_SIZE):
+        yield export_row(booking, guests)
+
+
+class Echo:
+    """A file-like object csv.writer can write to which gives each line straight back"""
+
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def csv_response(queryset: QuerySet[BookingRecord], filename: str) -> StreamingHttpResponse:
+    writer = csv.writer(Echo())
+    lines = (writer.writerow([csv_value(value) for value in row]) for row in export_rows(queryset))
+    response = StreamingHttpResponse(lines, content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="{}.csv"'.format(filename)
+    return response
+
+
+def xlsx_response(queryset: QuerySet[BookingRecord], filename: str) -> FileResponse:
+    workbook = Workbook(write_only=True, iso_dates=True)
+    worksheet = workbook.create_sheet(title='Bookings')
+    for row in export_rows(queryset):
+        worksheet.append(row)
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return FileResponse(
+        output,
+        as_attachment=True,
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        filename='{}.xlsx'.format(filename),
+    )
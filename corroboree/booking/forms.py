@@ -1,11 +1,12 @@
 import datetime
 
-import pytz
 from django import forms
 from django.core.validators import MinValueValidator
 from wagtail.admin import widgets
 
-from corroboree.booking.models import check_season_rules, booked_rooms, last_weekday_date, create_booking_cart_periods
+from corroboree.booking.models import check_season_rules, booked_rooms, create_booking_cart_periods
+from corroboree.booking.pricing import BOOKING_TIMEZONE, booking_window, pricing_tables
+from corroboree.booking.simulation import SIMULATED_FIELDS
 from corroboree.config import models as config
 
 
@@ -13,7 +14,7 @@ class BookingDateRangeForm(forms.Form):
     arrival_date = forms.DateField(
         label="Arrival date",
         validators=[
-            MinValueValidator(datetime.datetime.now(pytz.timezone('Australia/Sydney')).date()),
+            MinValueValidator(lambda: datetime.datetime.now(BOOKING_TIMEZONE).date()),  # today, not when loaded
         ],
         widget=widgets.AdminDateInput(
             attrs={
@@ -34,23 +35,13 @@ class BookingDateRangeForm(forms.Form):
 
     def clean(self):
         cleaned_data = super().clean()
-        conf = config.Config.objects.get()
+        conf = pricing_tables()  # already loaded in this worker, unlike Config
+        window = booking_window(conf)
         arrival_date = cleaned_data.get("arrival_date")
         departure_date = cleaned_data.get("departure_date")
-        # Time of day rollover checking
-        tod_rollover = conf.time_of_day_rollover
-        aest_now = datetime.datetime.now(pytz.timezone('Australia/Sydney'))
-        compare_date = aest_now.date() if aest_now.time() >= tod_rollover else aest_now.date() - datetime.timedelta(days=1)
-        last_week_start = last_weekday_date(compare_date, conf.week_start_day)
         max_weeks_till_booking = conf.max_weeks_till_booking
-        max_weeks_ahead_start = datetime.timedelta(
-            weeks=max_weeks_till_booking
-        )
-        max_weeks_ahead_end = datetime.timedelta(
-            weeks=(1 + max_weeks_till_booking)
-        )
         if arrival_date and departure_date:
-            if arrival_date > last_week_start + max_weeks_ahead_start:
+            if arrival_date > window.max_arrival_date:
                 raise forms.ValidationError(
                     "Arrival date is more than %s weeks ahead" % max_weeks_till_booking
                 )
@@ -58,7 +49,7 @@ class BookingDateRangeForm(forms.Form):
                 raise forms.ValidationError(
                     "Departure date must be after arrival date"
                 )
-            if departure_date > last_week_start + max_weeks_ahead_end:
+            if departure_date > window.max_departure_date:
                 raise forms.ValidationError(
                     "Departure date is more than %s weeks ahead" % (max_weeks_till_booking + 1)
                 )
@@ -96,10 +87,9 @@ class BookingRoomChoosingForm(forms.Form):
         if arrival_date is not None and departure_date is not None:
             booked_room_ids = booked_rooms(arrival_date, departure_date)
             booking_periods = create_booking_cart_periods(arrival_date, departure_date)
-            banned_rooms = config.Room.objects.none()  # empty queryset we will build up to filter available rooms with
+            banned_room_ids = set()  # room numbers we will build up to filter available rooms with
             for p in booking_periods:
-                banned_rooms = banned_rooms.union(p.banned_rooms())
-            banned_room_ids = banned_rooms.values_list('room_number')
+                banned_room_ids |= p.banned_rooms()
             available_rooms = config.Room.objects.exclude(pk__in=booked_room_ids).exclude(pk__in=banned_room_ids)
             self.fields["room_selection"].queryset = available_rooms
             self.fields["arrival_date"].initial = arrival_date
@@ -144,3 +134,56 @@ class GuestForm(forms.Form):
     email = forms.EmailField(label='Contact Email', required=False)
 
 
+class OccupancyReportForm(forms.Form):
+    start_year = forms.IntegerField(label="From year", min_value=2000, max_value=2100)
+    end_year = forms.IntegerField(label="To year", min_value=2000, max_value=2100)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_year = cleaned_data.get("start_year")
+        end_year = cleaned_data.get("end_year")
+        if start_year is not None and end_year is not None and end_year < start_year:
+            raise forms.ValidationError("The report must end in or after the year it starts")
+        return cleaned_data
+
+
+class PricingProposalForm(forms.Form):
+    """Proposed changes to each booking type, starting from its current rate, priority, minimum rooms and banned rooms,
+    see corroboree.booking.simulation"""
+    arrival_from = forms.DateField(label="Arriving from", required=False, widget=widgets.AdminDateInput)
+    arrival_to = forms.DateField(label="Arriving to", required=False, widget=widgets.AdminDateInput)
+
+    def __init__(self, *args, tables=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tables = pricing_tables() if tables is None else tables
+        room_choices = [(room.room_number, room.room_number) for room in self.tables.rooms]
+        for season in self.tables.seasons:
+            for booking_type in season.booking_types:
+                self.fields['rate_%s' % booking_type.pk] = forms.DecimalField(
+                    label="Rate", max_digits=8, decimal_places=2, initial=booking_type.rate)
+                self.fields['priority_rank_%s' % booking_type.pk] = forms.TypedChoiceField(
+                    label="Priority", choices=config.BookingType.Priorities.choices, coerce=int,
+                    initial=booking_type.priority_rank)
+                self.fields['minimum_rooms_%s' % booking_type.pk] = forms.IntegerField(
+                    label="Minimum rooms", min_value=0, initial=booking_type.minimum_rooms)
+                self.fields['banned_rooms_%s' % booking_type.pk] = forms.TypedMultipleChoiceField(
+                    label="Banned rooms", choices=room_choices, coerce=int, required=False,
+                    widget=forms.CheckboxSelectMultiple, initial=sorted(booking_type.banned_rooms))
+
+    def booking_type_rows(self):
+        """Each season's booking types with their fields, for laying the form out as a table"""
+        return [(season, booking_type, [self['%s_%s' % (field, booking_type.pk)] for field in SIMULATED_FIELDS])
+                for season in self.tables.seasons for booking_type in season.booking_types]
+
+    def changes(self) -> {int: dict}:
+        """The fields of each booking type which differ from the current ones"""
+        changes = {}
+        for season in self.tables.seasons:
+            for booking_type in season.booking_types:
+                proposed = {field: self.cleaned_data['%s_%s' % (field, booking_type.pk)] for field in SIMULATED_FIELDS}
+                proposed['banned_rooms'] = frozenset(proposed['banned_rooms'])
+                changed = {field: value for field, value in proposed.items()
+                           if value != getattr(booking_type, field)}
+                if changed:
+                    changes[booking_type.pk] = changed
+        return changes
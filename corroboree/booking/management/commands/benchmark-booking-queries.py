@@ -0,0 +1,151 @@
+import random
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from corroboree.booking.models import BookingRecord, RoomNight, booked_rooms, hold_expiry, live_room_nights, \
+    member_booking_summary
+from corroboree.booking.templatetags.booking_record_tags import render_booking_record
+from corroboree.config import models as config
+
+
+class Command(BaseCommand):
+    help = ("Seeds several seasons of bookings inside a transaction, prints EXPLAIN plans and timings for the "
+            "calendar, my-bookings and room chooser queries, then rolls everything back. Run it before and after "
+            "migrating to compare index changes. Fails if the my-bookings page takes more queries for a member with "
+            "more bookings.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=3, help='Years of bookings to seed')
+        parser.add_argument('--bookings-per-week', type=int, default=15)
+        parser.add_argument('--repeat', type=int, default=20, help='Times each query is run for timing')
+        parser.add_argument('--no-explain', action='store_true', help='Only print timings')
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Run even when DEBUG is off. Seeded rows are rolled back but still take locks while it runs.'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('Refusing to seed bookings with DEBUG off, use --force if this is not production')
+        rooms = list(config.Room.objects.all())
+        members = list(config.Member.objects.all())
+        if not rooms or not members:
+            raise CommandError('Needs a Config with rooms and members to seed bookings against')
+        self.stdout.write(f'Database: {connection.vendor}')
+        with transaction.atomic():
+            seeded = self.seed(rooms, members, options['years'], options['bookings_per_week'])
+            self.stdout.write(f'Seeded {seeded} bookings')
+            for name, queryset in self.queries(members[0]):
+                self.report(name, queryset, options['repeat'], not options['no_explain'])
+            summary_queries = self.summary_query_counts()
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Rolled back seeded bookings'))
+        if len(set(summary_queries.values())) > 1:
+            raise CommandError('my-bookings queries grow with the number of bookings: %s' % summary_queries)
+
+    def seed(self, rooms, members, years, bookings_per_week):
+        """Bulk insert bookings (and their rooms and nights) without firing signals"""
+        status = BookingRecord.BookingRecordStatus
+        statuses = [status.FINALISED] * 6 + [status.CANCELLED] * 2 + [status.IN_PROGRESS, status.SUBMITTED]
+        today = date.today()
+        weeks = years * 52
+        records = []
+        for week in range(-weeks, 27):
+            for _ in range(bookings_per_week):
+                member = random.choice(members)
+                arrival_date = today + timedelta(weeks=week, days=random.randint(0, 6))
+                records.append(BookingRecord(
+                    member=member,
+                    member_name_at_creation=member.full_name(),
+                    arrival_date=arrival_date,
+                    departure_date=arrival_date + timedelta(days=random.randint(1, 10)),
+                    status=random.choice(statuses),
+                ))
+        records = BookingRecord.objects.bulk_create(records, batch_size=1000)
+        if any(r.pk is None for r in records):  # backends that can't return ids from a bulk insert
+            records = list(BookingRecord.objects.order_by('-pk')[:len(records)])
+        # last_updated is auto_now so spread it out afterwards to give the expiry index something to do
+        for r in records:
+            if r.status in (status.IN_PROGRESS, status.SUBMITTED):
+                r.last_updated = timezone.now() - timedelta(hours=random.randint(0, 72))
+                r.expires_at = hold_expiry(r.status, r.last_updated)
+        BookingRecord.objects.bulk_update(records, ['last_updated', 'expires_at'], batch_size=1000)
+        through = BookingRecord.rooms.through
+        booking_rooms = []
+        nights = []
+        for r in records:
+            for room in random.sample(rooms, random.randint(1, 3)):
+                booking_rooms.append(through(bookingrecord_id=r.pk, room_id=room.pk))
+                if r.status != status.CANCELLED:
+                    nights.extend(RoomNight(booking_id=r.pk, room_id=room.pk, date=r.arrival_date + timedelta(days=d))
+                                  for d in range((r.departure_date - r.arrival_date).days))
+        through.objects.bulk_create(booking_rooms, batch_size=1000)
+        RoomNight.objects.bulk_create(nights, batch_size=2000)
+        return len(records)
+
+    def queries(self, member):
+        status = BookingRecord.BookingRecordStatus
+        today = date.today()
+        window_end = today + timedelta(weeks=6)
+        live = BookingRecord.live_objects.all()
+        return [
+            ('calendar: live bookings overlapping 6 weeks',
+             live.filter(departure_date__gt=today, arrival_date__lt=window_end)),
+            ('calendar: room nights for 6 weeks',
+             live_room_nights(today, window_end)),
+            ('my-bookings: upcoming',
+             live.filter(member=member, departure_date__gt=today, status=status.FINALISED).order_by('arrival_date')),
+            ('my-bookings: in progress',
+             live.filter(member=member, status=status.IN_PROGRESS).order_by('arrival_date')),
+            ('room chooser: booked rooms for a week',
+             booked_rooms(today + timedelta(weeks=4), today + timedelta(weeks=5))),
+            ('expire-bookings: expired holds',
+             BookingRecord.objects.filter(status=status.IN_PROGRESS, expires_at__lte=timezone.now())),
+        ]
+
+    def summary_query_counts(self) -> {int: int}:
+        """Queries taken to build and render the my-bookings page rows for the members with the fewest and most
+        bookings, which should be the same"""
+        counts = {}
+        by_bookings = config.Member.objects.annotate(booking_count=Count('bookings')).order_by('booking_count')
+        for member in (by_bookings.first(), by_bookings.last()):
+            with CaptureQueriesContext(connection) as queries:
+                summary = member_booking_summary(member)
+                for render_mode, bookings in (('IN_PROGRESS', summary['in_progress_bookings']),
+                                              ('SUMMARY', summary['submitted_bookings']),
+                                              ('FULL', summary['upcoming_bookings'])):
+                    for booking in bookings:
+                        render_to_string('templatetags/booking_record.html',
+                                         render_booking_record(booking, render_mode))
+            shown = sum(len(bookings) for bookings in summary.values())
+            if shown:  # with nothing to show the rooms prefetch is skipped
+                counts[shown] = len(queries)
+            self.stdout.write(self.style.MIGRATE_HEADING('my-bookings: page rows'))
+            self.stdout.write(f'  {shown} bookings shown in {len(queries)} queries')
+        return counts
+
+    def report(self, name, queryset, repeat, explain):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(queryset.all())
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        self.stdout.write('  median {median:.2f} ms, max {max:.2f} ms over {repeat} runs'.format(
+            median=timings[len(timings) // 2] * 1000,
+            max=timings[-1] * 1000,
+            repeat=repeat,
+        ))
+        if explain:
+            for line in queryset.explain().splitlines():
+                self.stdout.write('  ' + line)
@@ -0,0 +1,59 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from corroboree.booking.pricing import pricing_tables
+from corroboree.booking.pricing_checks import check_pricing, fixture_configs, percentile
+
+
+class Command(BaseCommand):
+    help = ("Prices every stay of up to --max-nights arriving on each day of --years against fixture configs, checks "
+            "the booking cart invariants and prints the pricing latency per stay. Fails on any broken invariant, or "
+            "when the 95th percentile latency is over --max-p95.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=2, help='Years of arrival dates to price')
+        parser.add_argument('--max-nights', type=int, default=21, help='Longest stay to price')
+        parser.add_argument('--start', type=date.fromisoformat, default=None,
+                            help='First arrival date, and the day the booking window is taken on. Defaults to today')
+        parser.add_argument('--live', action='store_true', help="Also check the site's own config")
+        parser.add_argument('--max-p95', type=float, default=None, metavar='MICROSECONDS',
+                            help='Fail if pricing a stay takes longer than this at the 95th percentile')
+        parser.add_argument('--show', type=int, default=20, help='Broken invariants to print for each config')
+
+    def handle(self, *args, **options):
+        if options['years'] < 1 or options['max_nights'] < 1:
+            raise CommandError('--years and --max-nights must be at least 1')
+        start = options['start'] or date.today()
+        configs = fixture_configs()
+        if options['live']:
+            configs['live'] = pricing_tables()
+        self.stdout.write('{config:<16} {stays:>9} {periods:>9} {unpriced:>9} {mean:>8} {p50:>8} {p95:>8} {p99:>8} '
+                          '{max:>8}'.format(config='Config', stays='Stays', periods='Periods', unpriced='Unpriced',
+                                            mean='Mean us', p50='p50', p95='p95', p99='p99', max='Max'))
+        failures = []
+        for name, tables in configs.items():
+            result = check_pricing(tables, start, options['years'], options['max_nights'])
+            timings = [seconds * 1e6 for seconds in result['timings']]
+            p95 = percentile(timings, 95)
+            self.stdout.write('{config:<16} {stays:>9} {periods:>9} {unpriced:>9} {mean:>8.1f} {p50:>8.1f} '
+                              '{p95:>8.1f} {p99:>8.1f} {max:>8.1f}'.format(
+                                  config=name,
+                                  stays=result['stays'],
+                                  periods=result['periods'],
+                                  unpriced=result['unpriced'],
+                                  mean=sum(timings) / len(timings) if timings else 0.0,
+                                  p50=percentile(timings, 50),
+                                  p95=p95,
+                                  p99=percentile(timings, 99),
+                                  max=timings[-1] if timings else 0.0,
+                              ))
+            for problem in result['problems'][:options['show']]:
+                self.stdout.write(self.style.ERROR(f'  {problem}'))
+            if result['problems']:
+                failures.append(f"{name}: {len(result['problems'])} broken invariants")
+            if options['max_p95'] is not None and p95 > options['max_p95']:
+                failures.append(f"{name}: p95 of {p95:.1f} us is over {options['max_p95']:.1f} us")
+        if failures:
+            raise CommandError('; '.join(failures))
+        self.stdout.write(self.style.SUCCESS('Every stay priced and held to the invariants.'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from corroboree.booking.occupancy import check_room_nights
+
+
+class Command(BaseCommand):
+    help = "Checks the RoomNight occupancy table agrees with the booking records"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-rows',
+            action='store_true',
+            help='List every missing or unexpected room night'
+        )
+
+    def handle(self, *args, **options):
+        missing, unexpected = check_room_nights()
+        if options['verbose_rows']:
+            for booking_id, room, night in sorted(missing):
+                self.stdout.write(f'Missing: booking {booking_id} room {room} on {night}')
+            for booking_id, room, night in sorted(unexpected):
+                self.stdout.write(f'Unexpected: booking {booking_id} room {room} on {night}')
+        if missing or unexpected:
+            raise CommandError(
+                'Occupancy is inconsistent: {missing} missing and {unexpected} unexpected room nights. '
+                'Run rebuild-room-nights to repair it.'.format(missing=len(missing), unexpected=len(unexpected))
+            )
+        self.stdout.write(self.style.SUCCESS('Occupancy is consistent with booking records.'))
@@ -1,7 +1,6 @@
 from django.core.management.base import BaseCommand, CommandError
+from corroboree.booking.expiry import BATCH_SIZE, bulk_update_status, expired_holds
 from corroboree.booking.models import BookingRecord
-from django.utils import timezone
-from datetime import timedelta
 
 class Command(BaseCommand):
     help = "Sets expired in progress or submitted bookings to cancelled"
@@ -12,37 +11,39 @@ class Command(BaseCommand):
             action='store_true',
             help='Show which bookings would be cancelled without saving changes'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Bookings cancelled per UPDATE'
+        )
+        parser.add_argument(
+            '--one-by-one',
+            action='store_true',
+            help='Cancel each booking with update_status() so save() and its signals run for every booking'
+        )
 
     def handle(self, *args, **options):
         status = BookingRecord.BookingRecordStatus
-        now = timezone.now()
-        # TODO: settings?
-        in_progress_limit = now - timedelta(minutes=30)
-        submitted_limit = now - timedelta(hours=24)
-        in_progress_expired = BookingRecord.objects.filter(
-            status=status.IN_PROGRESS,
-            last_updated__lt = in_progress_limit
-        )
-        submitted_expired = BookingRecord.objects.filter(
-            status=status.SUBMITTED,
-            last_updated__lt=submitted_limit
-        )
+        expired = expired_holds(status.IN_PROGRESS, status.SUBMITTED)
         if options['dry_run']:
             self.stdout.write('IN_PROGRESS bookings to cancel:')
-            for booking in in_progress_expired:
+            for booking in expired.filter(status=status.IN_PROGRESS):
                 self.stdout.write(f'{booking}')
             self.stdout.write('SUBMITTED bookings to cancel:')
-            for booking in submitted_expired:
+            for booking in expired.filter(status=status.SUBMITTED):
                 self.stdout.write(f'{booking}')
-        else:
-            # Update would be more efficient, but lose safeguards that might be implemented
-            for booking in in_progress_expired:
+            return
+        if options['one_by_one']:
+            counts = {}
+            for booking in expired:
+                counts[booking.status] = counts.get(booking.status, 0) + 1
                 booking.update_status(status.CANCELLED)
-            for booking in submitted_expired:
-                booking.update_status(status.CANCELLED)
-            self.stdout.write(self.style.SUCCESS(
-                'Cancelled {in_progress_count} bookings in progress and {submitted_count} submitted bookings.'.format(
-                    in_progress_count=in_progress_expired.count(),
-                    submitted_count=submitted_expired.count()
-                )
-            ))
\ No newline at end of file
+        else:
+            counts = bulk_update_status(expired, status.CANCELLED, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Cancelled {in_progress_count} bookings in progress and {submitted_count} submitted bookings.'.format(
+                in_progress_count=counts.get(status.IN_PROGRESS, 0),
+                submitted_count=counts.get(status.SUBMITTED, 0)
+            )
+        ))
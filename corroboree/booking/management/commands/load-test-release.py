@@ -0,0 +1,141 @@
+import random
+import threading
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Q
+
+from corroboree.booking.availability import cached_availability_data, snapshot_data
+from corroboree.booking.forms import BookingRoomChoosingForm
+from corroboree.booking.models import BookingRecord, RoomNight
+from corroboree.booking.pricing import booking_window
+from corroboree.booking.release import QUEUE_RETRY_SECONDS, prewarm_release_caches, release_snapshot, \
+    reserve_rooms_in_turn
+from corroboree.booking.reservations import reserve_rooms
+from corroboree.config import models as config
+
+
+class Command(BaseCommand):
+    help = ("Simulates members arriving at the rollover: each loads the calendar, opens the room chooser for the "
+            "newly released week and reserves some of the rooms it offers, all at the same moment. Reports latency "
+            "per step and checks no room night was double booked. Bookings it creates are deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=50, help='Number of members arriving at once')
+        parser.add_argument('--rooms-per-member', type=int, default=2)
+        parser.add_argument('--arrival', type=date.fromisoformat, default=None,
+                            help='Arrival date, defaults to the start of the most recently released week')
+        parser.add_argument('--nights', type=int, default=7)
+        parser.add_argument('--direct', action='store_true',
+                            help='Skip the release snapshot and queue, to compare against normal operation')
+        parser.add_argument('--keep', action='store_true', help="Don't delete the bookings that were created")
+        parser.add_argument('--force', action='store_true', help='Run even when DEBUG is off')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('Refusing to create bookings with DEBUG off, use --force if this is not production')
+        members = list(config.Member.objects.exclude(share_number=0))
+        if not members:
+            raise CommandError('Needs members to book with')
+        arrival_date = options['arrival'] or booking_window().max_arrival_date
+        departure_date = arrival_date + timedelta(days=options['nights'])
+        calendar_first_day = arrival_date.replace(day=1)
+        calendar_last_day = calendar_first_day + timedelta(weeks=6)
+        if not options['direct']:
+            prewarm_release_caches()
+
+        barrier = threading.Barrier(options['members'])
+        results = []
+        results_lock = threading.Lock()
+
+        def calendar():
+            snapshot = None if options['direct'] else release_snapshot(calendar_first_day, calendar_last_day)
+            if snapshot is None:
+                return cached_availability_data(calendar_first_day, calendar_last_day)
+            return snapshot_data(snapshot, calendar_first_day, calendar_last_day)
+
+        def reserve_queued(member, chosen):
+            """Ask for the member's turn until it comes, as the room chooser does"""
+            while True:
+                try:
+                    return reserve_rooms_in_turn(member, arrival_date, departure_date, chosen)
+                except ValidationError as e:
+                    if e.code != 'queued':
+                        raise
+                time.sleep(QUEUE_RETRY_SECONDS)
+
+        def attempt(member):
+            timings = {}
+            try:
+                barrier.wait()
+                start = time.perf_counter()
+                calendar()
+                timings['calendar'] = time.perf_counter() - start
+                start = time.perf_counter()
+                form = BookingRoomChoosingForm(arrival_date=arrival_date, departure_date=departure_date, member=member)
+                offered = list(form.fields['room_selection'].queryset)
+                timings['room chooser'] = time.perf_counter() - start
+                start = time.perf_counter()
+                chosen = random.sample(offered, min(options['rooms_per_member'], len(offered)))
+                try:
+                    if not chosen:
+                        outcome = ('nothing offered', None)
+                    else:
+                        booking = reserve_rooms(member, arrival_date, departure_date, chosen) if options['direct'] \
+                            else reserve_queued(member, chosen)
+                        outcome = ('reserved', booking.pk)
+                except ValidationError as e:
+                    outcome = (e.code or 'season rules', None)
+                except Exception as e:  # e.g. lock wait timeouts, reported rather than hidden
+                    outcome = ('error: %s' % type(e).__name__, None)
+                timings['reserve'] = time.perf_counter() - start
+                with results_lock:
+                    results.append((outcome, timings))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=attempt, args=(members[i % len(members)],))
+                   for i in range(options['members'])]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        created = [pk for (kind, pk), _ in results if kind == 'reserved']
+        counts = {}
+        for (kind, _), _ in results:
+            counts[kind] = counts.get(kind, 0) + 1
+        for kind, count in sorted(counts.items()):
+            self.stdout.write(f'{kind}: {count}')
+        self.stdout.write(f'{len(results)} members in {elapsed:.3f} s')
+        for step in ('calendar', 'room chooser', 'reserve'):
+            latencies = sorted(timings[step] for _, timings in results if step in timings)
+            if latencies:
+                self.stdout.write('{step}: median {median:.1f} ms, 95th {p95:.1f} ms, max {max:.1f} ms'.format(
+                    step=step,
+                    median=latencies[len(latencies) // 2] * 1000,
+                    p95=latencies[int(len(latencies) * 0.95)] * 1000,
+                    max=latencies[-1] * 1000,
+                ))
+
+        double_booked = RoomNight.objects.filter(
+            date__gte=arrival_date,
+            date__lt=departure_date,
+            booking__in=BookingRecord.live_objects.all(),
+        ).values('room', 'date').annotate(
+            bookings=Count('booking'),
+            reserved_here=Count('booking', filter=Q(booking__in=created)),
+        ).filter(bookings__gt=1, reserved_here__gt=0)
+        double_booked = list(double_booked)
+
+        if not options['keep']:
+            BookingRecord.objects.filter(pk__in=created).delete()
+        if double_booked:
+            raise CommandError('%s room nights were double booked' % len(double_booked))
+        self.stdout.write(self.style.SUCCESS('No room night was double booked'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from corroboree.booking.pricing import booking_window
+from corroboree.booking.release import prewarm_release_caches
+
+
+class Command(BaseCommand):
+    help = ("Fills the shared availability caches ahead of a week being released. Schedule it a couple of minutes "
+            "before Config.time_of_day_rollover on the week start day.")
+
+    def handle(self, *args, **options):
+        snapshot = prewarm_release_caches()
+        self.stdout.write(self.style.SUCCESS(
+            'Took an availability snapshot for {first} - {last}. The next week is released at {release}.'.format(
+                first=snapshot['first_day'],
+                last=snapshot['last_day'],
+                release=booking_window().next_release,
+            )
+        ))
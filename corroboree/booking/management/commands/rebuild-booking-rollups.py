@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from corroboree.booking.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recreates the occupancy and revenue report's rollup tables from the finalised booking records"
+
+    def handle(self, *args, **options):
+        days, months = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt rollups with {days} room day and {months} season month rows.'.format(days=days, months=months)
+        ))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from corroboree.booking.occupancy import rebuild_room_nights
+
+
+class Command(BaseCommand):
+    help = "Recreates the RoomNight occupancy table from scratch using the booking records"
+
+    def handle(self, *args, **options):
+        created = rebuild_room_nights()
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt occupancy with {created} room nights.'.format(created=created)
+        ))
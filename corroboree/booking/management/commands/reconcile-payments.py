@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from corroboree.booking.payments import BATCH_SIZE, reconcile_webhook_events
+from corroboree.booking.paypal import PaymentGatewayError
+
+
+class Command(BaseCommand):
+    help = ("Applies the PayPal events received by the webhook to their bookings' payment status, e.g. captures the "
+            "member's browser never reported and refunds made on PayPal")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Events applied per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            counts = reconcile_webhook_events(options['batch_size'])
+        except PaymentGatewayError as e:
+            raise CommandError('Stopped, events not yet applied are left pending: %s' % e.message)
+        self.stdout.write(self.style.SUCCESS(
+            'Applied {applied} events, ignored {ignored} and rejected {rejected}.'.format(**counts)
+        ))
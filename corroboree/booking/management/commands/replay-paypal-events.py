@@ -0,0 +1,71 @@
+import json
+import uuid
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from corroboree.booking.payments import CAPTURE_REFUNDED, CAPTURE_REVERSED
+
+
+def point_at_capture(event: dict, capture_id: str):
+    """Make an event about another capture, the way payments.event_capture reads it back"""
+    resource = event['resource']
+    if event.get('event_type') in (CAPTURE_REFUNDED, CAPTURE_REVERSED):  # the resource is a refund, up is its capture
+        for link in resource.get('links', []):
+            if link.get('rel') == 'up':
+                link['href'] = link['href'].rstrip('/').rsplit('/', 1)[0] + '/' + capture_id
+    else:  # the resource is the capture itself, up is its order
+        recorded_id = resource.get('id')
+        resource['id'] = capture_id
+        for link in resource.get('links', []):
+            if recorded_id and link.get('rel') in ('self', 'refund'):
+                link['href'] = link['href'].replace(recorded_id, capture_id)
+
+
+class Command(BaseCommand):
+    help = ("Posts recorded PayPal webhook events to the webhook, as PayPal would, to exercise it and "
+            "reconcile-payments. Each file holds one {\"headers\": ..., \"event\": ...} recording or a list of them, "
+            "see corroboree/booking/paypal_events/. Without --url the events are posted in process.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+')
+        parser.add_argument('--url', help='Webhook of a running server, e.g. http://localhost:8000/api/paypal-webhook/')
+        parser.add_argument('--booking', type=int, help='Make the events about this booking')
+        parser.add_argument('--capture', help='Make the events about this capture, i.e. a paypal_transaction_id')
+        parser.add_argument('--fresh-ids', action='store_true',
+                            help="Give each event a new id so it isn't dropped as one already received")
+        parser.add_argument('--force', action='store_true', help='Run even when DEBUG is off')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('Refusing to post made up payments with DEBUG off, '
+                               'use --force if this is not production')
+        recordings = []
+        for path in options['files']:
+            with open(path) as f:
+                recorded = json.load(f)
+            recordings.extend(recorded if isinstance(recorded, list) else [recorded])
+
+        client = None if options['url'] else Client()
+        for recording in recordings:
+            headers, event = recording['headers'], recording['event']
+            resource = event.setdefault('resource', {})
+            if options['fresh_ids']:
+                event['id'] = 'WH-' + uuid.uuid4().hex.upper()
+            if options['booking'] is not None:
+                resource['custom_id'] = str(options['booking'])
+            if options['capture'] is not None:
+                point_at_capture(event, options['capture'])
+            if client is None:
+                status = requests.post(options['url'], json=event, headers=headers, timeout=10).status_code
+            else:
+                status = client.post(reverse('paypal-webhook'), json.dumps(event), content_type='application/json',
+                                     headers=headers).status_code
+            self.stdout.write('{event_id} {event_type}: {status}'.format(
+                event_id=event['id'],
+                event_type=event['event_type'],
+                status=status,
+            ))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from corroboree.booking.outbox import BATCH_SIZE, drain_outbox
+
+
+class Command(BaseCommand):
+    help = "Sends queued booking emails over one mail server connection, retrying failures with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Emails claimed per transaction')
+        parser.add_argument(
+            '--loop',
+            type=int,
+            metavar='SECONDS',
+            default=None,
+            help='Keep running, checking for due emails every SECONDS'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            counts = drain_outbox(options['batch_size'])
+            if any(counts.values()) or options['loop'] is None:
+                self.stdout.write(self.style.SUCCESS(
+                    'Sent {sent} emails, {retrying} will be retried and {failed} have failed.'.format(**counts)
+                ))
+            if counts['postponed']:
+                self.stdout.write(self.style.ERROR(
+                    "Couldn't connect to the mail server, the remaining emails are still pending."
+                ))
+            if options['loop'] is None:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,95 @@
+import time
+from datetime import date, timedelta
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from corroboree.booking.models import BookingRecord
+from corroboree.config import models as config
+
+
+class Command(BaseCommand):
+    help = 'Send reminder emails for bookings arriving within the next week'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Render the reminders and list who would get them without sending anything'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Reminders sent before their bookings are marked as reminded'
+        )
+
+    def handle(self, *args, **options):
+        today = date.today()
+        bookings = BookingRecord.live_objects.filter(
+            arrival_date__gt=today,
+            arrival_date__lte=today + timedelta(weeks=1),
+            reminder_sent=False,
+            member_in_attendance__isnull=False,
+        ).select_related('member', 'member_in_attendance').prefetch_related(
+            Prefetch('rooms', queryset=config.Room.objects.select_related('room_type'))
+        ).order_by('arrival_date')
+
+        started = time.perf_counter()
+        reminders = [(booking, booking.related_email(
+            subject=f'Neige Booking Reminder: {booking.arrival_date} - {booking.departure_date}',
+            email_text='Please confirm the guests for your upcoming booking:'
+        )) for booking in bookings]
+        rendered = time.perf_counter() - started
+        self.stdout.write(f'Rendered {len(reminders)} reminders in {rendered:.2f} s')
+        if options['dry_run']:
+            for booking, message in reminders:
+                self.stdout.write(f'{booking}: {", ".join(message.to)}')
+            return
+
+        started = time.perf_counter()
+        delivered = failed = 0
+        connection = get_connection()
+        closed = True  # opened before the first reminder, and again after a failure
+        server_down = False
+        try:
+            for start in range(0, len(reminders), options['batch_size']):
+                if server_down:
+                    break
+                delivered_ids = []
+                try:
+                    for booking, message in reminders[start:start + options['batch_size']]:
+                        if closed:
+                            try:
+                                connection.open()
+                            except Exception as exc:  # the rest are left for the next run
+                                server_down = True
+                                self.stdout.write(self.style.ERROR(f'Could not connect to the mail server: {exc}'))
+                                break
+                            closed = False
+                        message.connection = connection
+                        try:
+                            connection.send_messages([message])
+                        except Exception as exc:  # left unmarked so the next run tries again
+                            failed += 1
+                            self.stdout.write(self.style.ERROR(
+                                f'Failed to send reminder for booking {booking.id}: {exc}'))
+                            connection.close()
+                            closed = True
+                        else:
+                            delivered_ids.append(booking.pk)
+                finally:  # mark whatever was delivered however the batch ended
+                    BookingRecord.objects.filter(pk__in=delivered_ids).update(reminder_sent=True)
+                    delivered += len(delivered_ids)
+        finally:
+            connection.close()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            'Sent {delivered} reminders in {elapsed:.2f} s ({rate:.1f}/s), {failed} failed.'.format(
+                delivered=delivered,
+                elapsed=elapsed,
+                rate=delivered / elapsed if elapsed else 0,
+                failed=failed,
+            )
+        ))
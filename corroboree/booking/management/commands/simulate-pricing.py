@@ -0,0 +1,74 @@
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from corroboree.booking.pricing import pricing_tables
+from corroboree.booking.simulation import SIMULATED_FIELDS, simulate_pricing, simulated_bookings
+
+
+def change_value(field: str, value: str):
+    if field == 'rate':
+        return Decimal(value)
+    if field == 'banned_rooms':
+        return frozenset(int(room) for room in value.split(',') if room)
+    return int(value)
+
+
+class Command(BaseCommand):
+    help = "Shows how much bookings would have cost, season by season, with some booking types changed"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--change',
+            action='append',
+            default=[],
+            metavar='TYPE:FIELD=VALUE',
+            help='A change to the booking type with primary key TYPE, where FIELD is one of {fields}. banned_rooms '
+                 'is a comma separated list of room numbers. Repeat for more changes'.format(
+                     fields=', '.join(SIMULATED_FIELDS))
+        )
+        parser.add_argument(
+            '--arrival-from',
+            type=date.fromisoformat,
+            help='Only reprice bookings arriving on or after this date'
+        )
+        parser.add_argument(
+            '--arrival-to',
+            type=date.fromisoformat,
+            help='Only reprice bookings arriving on or before this date'
+        )
+
+    def handle(self, *args, **options):
+        booking_types = {booking_type.pk: booking_type for season in pricing_tables().seasons
+                         for booking_type in season.booking_types}
+        changes = {}
+        for change in options['change']:
+            try:
+                booking_type, _, assignment = change.partition(':')
+                field, _, value = assignment.partition('=')
+                booking_type = int(booking_type)
+                if booking_type not in booking_types or field not in SIMULATED_FIELDS:
+                    raise ValueError(change)
+                changes.setdefault(booking_type, {})[field] = change_value(field, value)
+            except (ValueError, InvalidOperation):
+                raise CommandError('Not a change to a booking type: %s' % change)
+        for booking_type, fields in changes.items():
+            self.stdout.write('{name}: {fields}'.format(
+                name=booking_types[booking_type],
+                fields=', '.join('{field} {old} -> {new}'.format(
+                    field=field,
+                    old=getattr(booking_types[booking_type], field),
+                    new=value,
+                ) for field, value in fields.items()),
+            ))
+
+        result = simulate_pricing(changes, simulated_bookings(options['arrival_from'], options['arrival_to']))
+        self.stdout.write('{season:<24} {current:>14} {proposed:>14} {difference:>14}'.format(
+            season='Season', current='Current', proposed='Proposed', difference='Difference'))
+        for row in result['seasons'] + [dict(result, season='Total')]:
+            self.stdout.write('{season:<24} {current:>14,.2f} {proposed:>14,.2f} {difference:>+14,.2f}'.format(**row))
+        self.stdout.write(self.style.SUCCESS(
+            'Repriced {repriced} of {bookings} bookings in {seconds:.2f} s, {changed} change price and {unpriced} '
+            'no longer fit any booking type.'.format(**result)
+        ))
@@ -0,0 +1,97 @@
+import threading
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Q
+
+from corroboree.booking.models import BookingRecord, RoomNight
+from corroboree.booking.reservations import reserve_rooms
+from corroboree.config import models as config
+
+
+class Command(BaseCommand):
+    help = ("Fires many simultaneous reservations for the same rooms at the database and checks that no room night "
+            "ends up held by two bookings. Bookings it creates are deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=20, help='Number of simultaneous reservations')
+        parser.add_argument('--rooms', type=int, nargs='+', default=[1], help='Room numbers every thread asks for')
+        parser.add_argument('--arrival', type=date.fromisoformat, default=None,
+                            help='Arrival date, defaults to 20 weeks from today')
+        parser.add_argument('--nights', type=int, default=7)
+        parser.add_argument('--keep', action='store_true', help="Don't delete the bookings that were created")
+        parser.add_argument('--force', action='store_true', help='Run even when DEBUG is off')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('Refusing to create bookings with DEBUG off, use --force if this is not production')
+        members = list(config.Member.objects.exclude(share_number=0))
+        rooms = list(config.Room.objects.filter(room_number__in=options['rooms']))
+        if not members or len(rooms) != len(options['rooms']):
+            raise CommandError('Needs members and the requested rooms to exist')
+        arrival_date = options['arrival'] or date.today() + timedelta(weeks=20)
+        departure_date = arrival_date + timedelta(days=options['nights'])
+
+        barrier = threading.Barrier(options['threads'])
+        results = []
+        results_lock = threading.Lock()
+
+        def attempt(member):
+            try:
+                barrier.wait()
+                start = time.perf_counter()
+                try:
+                    booking = reserve_rooms(member, arrival_date, departure_date, rooms)
+                    outcome = ('reserved', booking.pk)
+                except ValidationError as e:
+                    outcome = ('rooms taken' if e.code == 'rooms_taken' else 'season rules', None)
+                except Exception as e:  # e.g. lock wait timeouts, reported rather than hidden
+                    outcome = ('error: %s' % type(e).__name__, None)
+                with results_lock:
+                    results.append((outcome, time.perf_counter() - start))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=attempt, args=(members[i % len(members)],))
+                   for i in range(options['threads'])]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        created = [pk for (kind, pk), _ in results if kind == 'reserved']
+        counts = {}
+        for (kind, _), _ in results:
+            counts[kind] = counts.get(kind, 0) + 1
+        latencies = sorted(latency for _, latency in results)
+        for kind, count in sorted(counts.items()):
+            self.stdout.write(f'{kind}: {count}')
+        self.stdout.write('{n} reservations in {elapsed:.3f} s, median {median:.1f} ms, max {max:.1f} ms'.format(
+            n=len(results),
+            elapsed=elapsed,
+            median=latencies[len(latencies) // 2] * 1000,
+            max=latencies[-1] * 1000,
+        ))
+
+        double_booked = RoomNight.objects.filter(
+            date__gte=arrival_date,
+            date__lt=departure_date,
+            room__in=rooms,
+            booking__in=BookingRecord.live_objects.all(),
+        ).values('room', 'date').annotate(
+            bookings=Count('booking'),
+            reserved_here=Count('booking', filter=Q(booking__in=created)),
+        ).filter(bookings__gt=1, reserved_here__gt=0)
+        double_booked = list(double_booked)
+
+        if not options['keep']:
+            BookingRecord.objects.filter(pk__in=created).delete()
+        if double_booked:
+            raise CommandError('%s room nights were double booked' % len(double_booked))
+        self.stdout.write(self.style.SUCCESS('No room night was double booked'))
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.15 on 2026-10-17 16:06
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_room_nights(apps, schema_editor):
+    BookingRecord = apps.get_model('booking', 'BookingRecord')
+    RoomNight = apps.get_model('booking', 'RoomNight')
+    stays = BookingRecord.objects.exclude(status='CX').filter(rooms__isnull=False).values_list(
+        'pk', 'arrival_date', 'departure_date', 'rooms__room_number')
+    nights = []
+    for booking_id, arrival_date, departure_date, room in stays.iterator():
+        for offset in range((departure_date - arrival_date).days):
+            nights.append(RoomNight(booking_id=booking_id, room_id=room,
+                                    date=arrival_date + datetime.timedelta(days=offset)))
+    RoomNight.objects.bulk_create(nights, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0021_bookingrecord_send_admin_email'),
+        ('config', '0012_rename_flexible_booking_period_config_flexible_booking_weeks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomNight',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_nights', to='booking.bookingrecord')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_nights', to='config.room')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'room'], name='roomnight_date_room_idx')],
+                'constraints': [models.UniqueConstraint(fields=('booking', 'room', 'date'), name='unique_booking_room_night')],
+            },
+        ),
+        migrations.RunPython(populate_room_nights, migrations.RunPython.noop),
+    ]
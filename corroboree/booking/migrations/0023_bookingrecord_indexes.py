@@ -0,0 +1,26 @@
+# Generated by Django 5.1.15 on 2026-10-17 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0022_roomnight'),
+        ('config', '0012_rename_flexible_booking_period_config_flexible_booking_weeks'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookingrecord',
+            index=models.Index(fields=['status', 'last_updated'], name='booking_status_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookingrecord',
+            index=models.Index(fields=['departure_date', 'arrival_date'], name='booking_dates_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookingrecord',
+            index=models.Index(fields=['member', 'status', 'arrival_date'], name='booking_member_status_idx'),
+        ),
+    ]
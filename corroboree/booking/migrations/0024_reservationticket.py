@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-17 16:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0023_bookingrecord_indexes'),
+        ('config', '0012_rename_flexible_booking_period_config_flexible_booking_weeks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservationTicket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('member', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='config.member')),
+            ],
+        ),
+    ]
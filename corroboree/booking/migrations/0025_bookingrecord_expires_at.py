@@ -0,0 +1,40 @@
+# Generated by Django 5.1.15 on 2026-10-17 17:17
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def populate_expires_at(apps, schema_editor):
+    BookingRecord = apps.get_model('booking', 'BookingRecord')
+    BookingRecord.objects.filter(status='PR').update(
+        expires_at=F('last_updated') + datetime.timedelta(seconds=settings.BOOKING_IN_PROGRESS_HOLD_LIMIT))
+    BookingRecord.objects.filter(status='SB').update(
+        expires_at=F('last_updated') + datetime.timedelta(seconds=settings.BOOKING_SUBMITTED_HOLD_LIMIT))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0024_reservationticket'),
+        ('config', '0012_rename_flexible_booking_period_config_flexible_booking_weeks'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='bookingrecord',
+            name='booking_status_updated_idx',
+        ),
+        migrations.AddField(
+            model_name='bookingrecord',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When an in progress or submitted booking stops holding its rooms. Set on save from the status', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='bookingrecord',
+            index=models.Index(fields=['status', 'expires_at'], name='booking_status_expires_idx'),
+        ),
+        migrations.RunPython(populate_expires_at, migrations.RunPython.noop),
+    ]
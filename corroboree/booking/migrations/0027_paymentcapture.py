@@ -0,0 +1,26 @@
+# Generated by Django 5.1.15 on 2026-10-17 17:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0026_outboundemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentCapture',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.CharField(max_length=36, unique=True)),
+                ('status', models.CharField(choices=[('IP', 'In Progress'), ('CP', 'Completed')], default='IP', max_length=2)),
+                ('response', models.JSONField(blank=True, default=dict)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('booking', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='captures', to='booking.bookingrecord')),
+            ],
+        ),
+    ]
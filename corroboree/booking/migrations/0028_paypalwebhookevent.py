@@ -0,0 +1,32 @@
+# Generated by Django 5.1.15 on 2026-10-17 17:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0027_paymentcapture'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayPalWebhookEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=64, unique=True)),
+                ('event_type', models.CharField(max_length=64)),
+                ('headers', models.JSONField(default=dict, help_text='The PAYPAL-* headers needed to verify the event')),
+                ('event', models.JSONField()),
+                ('received', models.DateTimeField(auto_now_add=True)),
+                ('outcome', models.CharField(choices=[('PE', 'Pending'), ('AP', 'Applied'), ('IG', 'Ignored'), ('RJ', 'Rejected')], default='PE', max_length=2)),
+                ('detail', models.CharField(blank=True, max_length=255)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('booking', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='paypal_events', to='booking.bookingrecord')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['outcome', 'received'], name='paypal_event_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0028_paypalwebhookevent'),
+        ('config', '0012_rename_flexible_booking_period_config_flexible_booking_weeks'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookingrecord',
+            index=models.Index(fields=['arrival_date', 'id'], name='booking_arrival_idx'),
+        ),
+    ]
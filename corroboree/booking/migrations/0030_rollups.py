@@ -0,0 +1,44 @@
+# Generated by Django 5.1.15 on 2026-10-17 17:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0029_bookingrecord_arrival_idx'),
+        ('config', '0012_rename_flexible_booking_period_config_flexible_booking_weeks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomDayRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('room_nights', models.PositiveIntegerField()),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('booking_type', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='config.bookingtype')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='config.room')),
+                ('season', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='config.season')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'room'], name='rollup_day_room_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SeasonMonthRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='The first day of the month')),
+                ('room_nights', models.PositiveIntegerField()),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('booking_type', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='config.bookingtype')),
+                ('season', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='config.season')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['month'], name='rollup_month_idx')],
+            },
+        ),
+    ]
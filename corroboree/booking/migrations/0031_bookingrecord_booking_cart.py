@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 17:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0030_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookingrecord',
+            name='booking_cart',
+            field=models.JSONField(blank=True, default=list, editable=False, help_text='The priced periods as quoted, see BookingCartLine. Empty for bookings made before quotes were kept'),
+        ),
+    ]
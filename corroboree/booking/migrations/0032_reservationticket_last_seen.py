@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0031_bookingrecord_booking_cart'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservationticket',
+            name='last_seen',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
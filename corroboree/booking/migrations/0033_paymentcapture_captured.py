@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0032_reservationticket_last_seen'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentcapture',
+            name='status',
+            field=models.CharField(choices=[('IP', 'In Progress'), ('CD', 'Captured'), ('CP', 'Completed')], default='IP', max_length=2),
+        ),
+    ]
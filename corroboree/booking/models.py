@@ -1,19 +1,16 @@
 import datetime
 from datetime import date, datetime, timedelta
 
-import pytz
 from django.conf import settings
 from django.contrib import messages
 from django.core.exceptions import ValidationError, PermissionDenied
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives
 from django.db import models
-from django.db.models import Sum, Q, QuerySet
+from django.db.models import Count, Sum, Prefetch, Q, QuerySet
 from django.forms import formset_factory
 from django.http import Http404
 from django.shortcuts import render, redirect
-from django.template.loader import render_to_string
 from django.utils import timezone
-from django.utils.html import strip_tags
 from django.views.decorators.csrf import csrf_protect
 from wagtail.admin.panels import FieldPanel, MultiFieldPanel
 from wagtail.contrib.routable_page.models import RoutablePageMixin, path
@@ -21,30 +18,35 @@ from wagtail.fields import RichTextField
 from wagtail.models import Page
 
 from corroboree.config import models as config
-from corroboree.config.models import Season, Room, BookingType
+from corroboree.booking.emails import render_booking_email
+from corroboree.booking.pricing import BookingCartLine, BookingTypeRule, BookingWindow, PricingTables, SeasonRule, \
+    booking_window, last_weekday_date, pricing_tables
+from corroboree.config.models import Room
+
+# How long a booking holds its rooms without being updated
+IN_PROGRESS_HOLD_LIMIT = timedelta(seconds=settings.BOOKING_IN_PROGRESS_HOLD_LIMIT)
+SUBMITTED_HOLD_LIMIT = timedelta(seconds=settings.BOOKING_SUBMITTED_HOLD_LIMIT)
+
+
+def hold_expiry(status: str, updated: datetime) -> datetime | None:
+    """When a booking of this status, saved at updated, stops holding its rooms. None if it never expires"""
+    if status == BookingRecord.BookingRecordStatus.IN_PROGRESS:
+        return updated + IN_PROGRESS_HOLD_LIMIT
+    if status == BookingRecord.BookingRecordStatus.SUBMITTED:
+        return updated + SUBMITTED_HOLD_LIMIT
+    return None
 
 
 class LiveBookingRecordManager(models.Manager):
     """Filters out records which are not live from querysets.
 
-    Live means that they have not been cancelled, expired, or taken place in the past"""
+    Live means that they have not been cancelled, expired, or taken place in the past. Expiry is materialised in
+    expires_at when a booking is saved so this is a plain indexed comparison rather than one per status"""
 
     def get_queryset(self):
         status = BookingRecord.BookingRecordStatus
-        now = timezone.now()
-        # TODO: settings?
-        in_progress_limit = now - timedelta(minutes=30)
-        submitted_limit = now - timedelta(hours=24)
         queryset = super().get_queryset().exclude(status=status.CANCELLED)
-        queryset = queryset.exclude(
-            Q(status=status.IN_PROGRESS) &
-            Q(last_updated__lt=in_progress_limit)
-        )
-        queryset = queryset.exclude(
-            Q(status=status.SUBMITTED) &
-            Q(last_updated__lt=submitted_limit)
-        )
-        return queryset
+        return queryset.filter(Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()))
 
 
 class BookingRecord(models.Model):
@@ -66,6 +68,9 @@ class BookingRecord(models.Model):
                                                help_text="The name of the original member who booked. "
                                                          "Used for record keeping when shares are transferred")
     last_updated = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField(null=True, blank=True, editable=False,
+                                      help_text="When an in progress or submitted booking stops holding its rooms. "
+                                                "Set on save from the status")
     arrival_date = models.DateField()
     departure_date = models.DateField()
     rooms = models.ManyToManyField(config.Room)
@@ -77,6 +82,9 @@ class BookingRecord(models.Model):
                                                                        "Used for record keeping when shares are transferred")
     other_attendees = models.JSONField(default=dict, blank=True)  # {guest_n: {first_name:, last_name:, contact_email:}}
     cost = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    booking_cart = models.JSONField(default=list, blank=True, editable=False,
+                                    help_text="The priced periods as quoted, see BookingCartLine. Empty for bookings "
+                                              "made before quotes were kept")
     payment_status = models.CharField(max_length=2, choices=BookingRecordPaymentStatus,
                                       default=BookingRecordPaymentStatus.NOT_ISSUED)
     paypal_transaction_id = models.CharField(max_length=20, blank=True)
@@ -89,6 +97,18 @@ class BookingRecord(models.Model):
     objects = models.Manager()
     live_objects = LiveBookingRecordManager()
 
+    class Meta:
+        indexes = [
+            # LiveBookingRecordManager and expire-bookings expiry of holds
+            models.Index(fields=['status', 'expires_at'], name='booking_status_expires_idx'),
+            # overlap queries (departure after start and arrival before end)
+            models.Index(fields=['departure_date', 'arrival_date'], name='booking_dates_idx'),
+            # a member's bookings by status, e.g. the my-bookings page
+            models.Index(fields=['member', 'status', 'arrival_date'], name='booking_member_status_idx'),
+            # the bookings admin listing, paged by (arrival_date, id)
+            models.Index(fields=['arrival_date', 'id'], name='booking_arrival_idx'),
+        ]
+
     def __str__(self):
         return '[{id}] {start} - {end}: {member}'.format(
             id=self.pk,
@@ -97,25 +117,43 @@ class BookingRecord(models.Model):
             member=self.member,
         )
 
+    def save(self, *args, **kwargs):
+        self.expires_at = hold_expiry(self.status, timezone.now())
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {'expires_at', *update_fields}
+        super().save(*args, **kwargs)
+
     def rooms_list(self):
         rooms = list(self.rooms.all())
         return ', '.join(str(r) for r in rooms)
 
     def calculate_booking_cart(self):
+        """Price the booking and keep the priced periods as its quote"""
         periods = create_booking_cart_periods(self.arrival_date, self.departure_date)
-        cost = 0
+        rooms = list(self.rooms.all())
+        lines = []
         for p in periods:
-            p.set_rooms(self.rooms.all())
+            p.set_rooms(rooms)
             p.set_cost()
-            cost = cost + p.cost
-        self.cost = cost
+            lines.append(BookingCartLine.from_period(p))
+        self.booking_cart = [line.to_json() for line in lines]
+        self.cost = sum(line.cost for line in lines)
         self.save()
-    # TODO: Proper workflow n shit for the periods and showing them. Serialise?
-    def explain_booking_cart(self):  # Temporary generator
+
+    def booking_cart_lines(self) -> [BookingCartLine]:
+        """The priced periods as quoted when calculate_booking_cart last ran"""
+        return [BookingCartLine.from_json(line) for line in self.booking_cart]
+
+    def explain_booking_cart(self) -> [str]:
+        """The quoted periods, or for bookings made before quotes were kept, the periods as they would be priced now"""
+        if self.booking_cart:
+            return [str(line) for line in self.booking_cart_lines()]
         periods = create_booking_cart_periods(self.arrival_date, self.departure_date)
+        rooms = list(self.rooms.all())
         strs = []
         for p in periods:
-            p.set_rooms(self.rooms.all())
+            p.set_rooms(rooms)
             p.set_cost()
             strs.append(str(p))
         return strs
@@ -132,33 +170,194 @@ class BookingRecord(models.Model):
         self.status = status
         self.save()
 
-    def send_related_email(self, subject, email_text):
-        """Format and send an email using a django template"""
+    def related_email(self, subject, email_text, connection=None) -> EmailMultiAlternatives:
+        """Format an email about this booking to its member and member in attendance, see corroboree.booking.emails"""
         from_email = settings.BOOKING_FROM_EMAIL
         recipients = [self.member.contact_email]
         if self.member_in_attendance.contact_email != self.member.contact_email:
             recipients.append(self.member_in_attendance.contact_email)
-        attendees = list(self.other_attendees.values())
-        attendees = [x for x in attendees if
-                     x['first_name'] != '' and x['last_name'] != '' and x['email'] != '']
-        html_message = render_to_string(
-            'email/confirmation_mail_template.html',
-            {'booking': self, 'email_text': email_text, 'attendees': attendees}
-        )
-        plain_message = strip_tags(html_message)
-        send_mail(
-            subject,
-            plain_message,
-            from_email,
-            recipients,
-            html_message=html_message,
+        plain_message, html_message = render_booking_email(self, email_text)
+        message = EmailMultiAlternatives(subject, plain_message, from_email, recipients, connection=connection)
+        message.attach_alternative(html_message, 'text/html')
+        return message
+
+    def send_related_email(self, subject, email_text):
+        """Queue an email about this booking to be sent by send-outbox"""
+        message = self.related_email(subject, email_text)
+        OutboundEmail.objects.create(
+            booking=self,
+            subject=message.subject,
+            body=message.body,
+            html_body=message.alternatives[0][0],
+            from_email=settings.BOOKING_FROM_EMAIL or '',
+            recipients=message.to,
         )
 
 
+class OutboundEmail(models.Model):
+    """An email waiting to be sent, or the record of one that was.
+
+    Requests only insert rows here so a slow mail server can't hold them up. The send-outbox command sends them over
+    one SMTP connection and retries failures with backoff, see corroboree.booking.outbox"""
+    class OutboundEmailStatus(models.TextChoices):
+        PENDING = "PE"
+        SENT = "ST"
+        FAILED = "FL"
+
+    booking = models.ForeignKey(BookingRecord, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name="emails")
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254, blank=True, help_text="Blank for DEFAULT_FROM_EMAIL")
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=2, choices=OutboundEmailStatus, default=OutboundEmailStatus.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return '[{id}] {subject}: {status}'.format(id=self.pk, subject=self.subject, status=self.status)
+
+
+class RoomNight(models.Model):
+    """A room occupied for one night by a booking which has not been cancelled.
+
+    Denormalised from BookingRecord so occupancy can be read with an indexed range scan over dates. Rows are kept in
+    step with their booking by signals, see corroboree.booking.occupancy"""
+    booking = models.ForeignKey(BookingRecord, on_delete=models.CASCADE, related_name="room_nights")
+    room = models.ForeignKey(config.Room, on_delete=models.CASCADE, related_name="room_nights")
+    date = models.DateField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'room'], name='roomnight_date_room_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['booking', 'room', 'date'], name='unique_booking_room_night'),
+        ]
+
+    def __str__(self):
+        return '{date}: Room {room} [{booking}]'.format(date=self.date, room=self.room_id, booking=self.booking_id)
+
+
+class ReservationTicket(models.Model):
+    """A member's place in the queue for reserving rooms while a week is being released.
+
+    Tickets are taken in arrival order and a member can only hold one, see corroboree.booking.release"""
+    member = models.OneToOneField(config.Member, on_delete=models.CASCADE, related_name="+")
+    created = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(auto_now=True)  # when the member last asked for their turn
+
+    def __str__(self):
+        return '{pk}: {member}'.format(pk=self.pk, member=self.member_id)
+
+
+class PaymentCapture(models.Model):
+    """The capture of one PayPal order, so a retried or double clicked capture is answered from here.
+
+    Taken before PayPal is asked to capture, given PayPal's response as soon as it arrives and completed in the same
+    transaction that finalises the booking, see corroboree.booking.payments"""
+    class PaymentCaptureStatus(models.TextChoices):
+        IN_PROGRESS = "IP"
+        CAPTURED = "CD"  # PayPal has captured, the booking isn't finalised yet
+        COMPLETED = "CP"
+
+    order_id = models.CharField(max_length=36, unique=True)
+    booking = models.ForeignKey(BookingRecord, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name="captures")
+    status = models.CharField(max_length=2, choices=PaymentCaptureStatus, default=PaymentCaptureStatus.IN_PROGRESS)
+    response = models.JSONField(default=dict, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{order_id}: {status}'.format(order_id=self.order_id, status=self.get_status_display())
+
+
+class PayPalWebhookEvent(models.Model):
+    """A notification PayPal sent to the webhook, stored as received and applied later by reconcile-payments.
+
+    Rows are only ever added by the webhook, reconciliation records its outcome without touching what was received,
+    see corroboree.booking.payments"""
+    class PayPalWebhookEventOutcome(models.TextChoices):
+        PENDING = "PE"
+        APPLIED = "AP"
+        IGNORED = "IG"
+        REJECTED = "RJ"  # PayPal didn't confirm it sent the event
+
+    event_id = models.CharField(max_length=64, unique=True)
+    event_type = models.CharField(max_length=64)
+    headers = models.JSONField(default=dict, help_text="The PAYPAL-* headers needed to verify the event")
+    event = models.JSONField()
+    received = models.DateTimeField(auto_now_add=True)
+    outcome = models.CharField(max_length=2, choices=PayPalWebhookEventOutcome,
+                               default=PayPalWebhookEventOutcome.PENDING)
+    detail = models.CharField(max_length=255, blank=True)
+    booking = models.ForeignKey(BookingRecord, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name="paypal_events")
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # reconcile-payments finding pending events, oldest first
+            models.Index(fields=['outcome', 'received'], name='paypal_event_pending_idx'),
+        ]
+
+    def __str__(self):
+        return '{event_id}: {event_type}'.format(event_id=self.event_id, event_type=self.event_type)
+
+
+class RoomDayRollup(models.Model):
+    """A room's night sold to finalised bookings, with the season and booking type it was priced under and its share
+    of what was paid.
+
+    Reporting only, rebuilt from the booking records each night by rebuild-booking-rollups, see
+    corroboree.booking.rollups"""
+    date = models.DateField()
+    room = models.ForeignKey(config.Room, on_delete=models.CASCADE, related_name="+")
+    season = models.ForeignKey(config.Season, on_delete=models.SET_NULL, null=True, related_name="+")
+    booking_type = models.ForeignKey(config.BookingType, on_delete=models.SET_NULL, null=True, related_name="+")
+    room_nights = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'room'], name='rollup_day_room_idx'),
+        ]
+
+    def __str__(self):
+        return '{date}: Room {room}'.format(date=self.date, room=self.room_id)
+
+
+class SeasonMonthRollup(models.Model):
+    """RoomDayRollup summed by month, season and booking type"""
+    month = models.DateField(help_text="The first day of the month")
+    season = models.ForeignKey(config.Season, on_delete=models.SET_NULL, null=True, related_name="+")
+    booking_type = models.ForeignKey(config.BookingType, on_delete=models.SET_NULL, null=True, related_name="+")
+    room_nights = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['month'], name='rollup_month_idx'),
+        ]
+
+    def __str__(self):
+        return '{month:%B %Y}: {season}'.format(month=self.month, season=self.season_id)
+
 
 class BookingCartPeriod:
-    def __init__(self, start_date: date, end_date: date, start_season: Season, end_season: Season,
-                 is_full_week: bool, is_flexible_period: bool, is_last_minute_period: bool):
+    def __init__(self, start_date: date, end_date: date, start_season: SeasonRule, end_season: SeasonRule,
+                 is_full_week: bool, is_flexible_period: bool, is_last_minute_period: bool,
+                 tables: PricingTables = None):
         self.start_date = start_date
         self.end_date = end_date
         self.start_season = start_season
@@ -166,7 +365,9 @@ class BookingCartPeriod:
         self.is_full_week = is_full_week
         self.is_flexible_period = is_flexible_period
         self.is_last_minute_period = is_last_minute_period
+        self.tables = pricing_tables() if tables is None else tables
         self.rooms = None
+        self.room_numbers = frozenset()
         self.valid_booking_types = (None, None)
         self.booking_type = None
         self.cost = None
@@ -182,80 +383,88 @@ class BookingCartPeriod:
 
     def __str__(self):
         return (f"Period: {self.start_date} - {self.end_date}, "
-                f"Rate: {self.booking_type}, Rooms: {self.rooms.count()}, "
+                f"Rate: {self.booking_type}, Rooms: {len(self.room_numbers)}, "
                 f"Cost ${self.cost}")
 
-    def set_rooms(self, rooms: QuerySet[Room]):
+    def set_rooms(self, rooms: [Room]):
         self.rooms = rooms
+        self.room_numbers = frozenset(r.room_number for r in rooms)
 
     def set_cost(self):
+        """Choose the booking type and price the period, leaving both None if no booking type fits"""
         booking_types, _ = self.valid_booking_types
-        filtered_booking_types = booking_types.exclude(banned_rooms__in=self.rooms).exclude(minimum_rooms__gt=self.rooms.count())
-        self.booking_type = filtered_booking_types.order_by('priority_rank').first()
+        room_count = len(self.room_numbers)
+        # booking types are already in priority order
+        filtered_booking_types = [t for t in booking_types or () if
+                                  not t.banned_rooms & self.room_numbers and t.minimum_rooms <= room_count]
+        self.booking_type = filtered_booking_types[0] if filtered_booking_types else None
+        if self.booking_type is None:
+            self.cost = None
+            return
         if self.booking_type.is_full_week_only:
             per_room_cost = self.booking_type.rate
         else:
             per_room_cost = self.booking_type.rate * (self.end_date - self.start_date).days
             # Cap daily rates to maximum
-            try:
-                capping_type = self.start_season.booking_types.get(sets_weekly_rate_cap=True)
+            capping_type = self.start_season.weekly_rate_cap()
+            if capping_type is not None:
                 per_room_cost = min(per_room_cost, capping_type.rate)
-            except BookingType.DoesNotExist:
-                pass
         if self.booking_type.is_flat_rate:
             self.cost = per_room_cost
         else:
-            self.cost = per_room_cost * self.rooms.count()
+            self.cost = per_room_cost * room_count
 
     def set_valid_booking_types(self):
-        booking_types = self.start_season.booking_types.all()
         # Filter down to possible type
-        filtered_booking_types = booking_types
-        if not self.is_full_week:
-            filtered_booking_types = filtered_booking_types.exclude(is_full_week_only=True)
-        if not self.is_flexible_period:
-            filtered_booking_types = filtered_booking_types.exclude(requires_flexible_booking_period=True)
-        if not self.is_last_minute_period:
-            filtered_booking_types = filtered_booking_types.exclude(requires_last_minute_booking_period=True)
+        filtered_booking_types = filter_booking_types(self.start_season.booking_types,
+                                                      is_full_week=self.is_full_week,
+                                                      is_flexible_period=self.is_flexible_period,
+                                                      is_last_minute_period=self.is_last_minute_period)
         # Make sure any portions in a new season don't violate room restrictions
         if self.start_season != self.end_season:
-            end_season_booking_types = self.end_season.booking_types.all()
             # Need to check whether this is a full week under the new season
             if self.end_season.requires_strict_weeks and not self.is_last_minute_period:
-                week_start_day = self.end_season.config.week_start_day
+                week_start_day = self.tables.week_start_day
                 is_full_week_for_end_season = (self.start_date.weekday() == week_start_day and
                                                (self.end_date - self.start_date).days == 7)
             else:
                 is_full_week_for_end_season = True if (self.end_date - self.start_date).days == 7 else False
-            end_season_filtered_booking_types = end_season_booking_types
-            if not is_full_week_for_end_season:
-                end_season_filtered_booking_types = end_season_filtered_booking_types.exclude(is_full_week_only=True)
-            if not self.is_flexible_period:
-                end_season_filtered_booking_types = end_season_filtered_booking_types.exclude(requires_flexible_booking_period=True)
-            if not self.is_last_minute_period:
-                end_season_filtered_booking_types = end_season_filtered_booking_types.exclude(requires_last_minute_booking_period=True)
+            end_season_filtered_booking_types = filter_booking_types(self.end_season.booking_types,
+                                                                     is_full_week=is_full_week_for_end_season,
+                                                                     is_flexible_period=self.is_flexible_period,
+                                                                     is_last_minute_period=self.is_last_minute_period)
             # Validate if there is a compatible booking type in both seasons
-            if filtered_booking_types.exists() and end_season_filtered_booking_types.exists():
+            if filtered_booking_types and end_season_filtered_booking_types:
                 self.valid_booking_types = (filtered_booking_types, end_season_filtered_booking_types)
             else:
                 self.valid_booking_types = (None, None)
         else:
-            if filtered_booking_types.exists():
+            if filtered_booking_types:
                 self.valid_booking_types = (filtered_booking_types, filtered_booking_types)
             else:
                 self.valid_booking_types = (None, None)
 
-    def banned_rooms(self):
+    def banned_rooms(self) -> frozenset:
+        """Room numbers which no valid booking type in the period allows"""
         start_types, end_types = self.valid_booking_types
-        rooms = self.start_season.config.rooms.all()
+        rooms = self.tables.room_numbers
         start_banned_rooms = rooms
         end_banned_rooms = rooms
         if start_types and end_types:
             for booking_type in start_types:
-                start_banned_rooms = start_banned_rooms & booking_type.banned_rooms.all()
+                start_banned_rooms = start_banned_rooms & booking_type.banned_rooms
             for booking_type in end_types:
-                end_banned_rooms = end_banned_rooms & booking_type.banned_rooms.all()
-        return start_banned_rooms.union(end_banned_rooms)
+                end_banned_rooms = end_banned_rooms & booking_type.banned_rooms
+        return start_banned_rooms | end_banned_rooms
+
+
+def filter_booking_types(booking_types: [BookingTypeRule], is_full_week: bool, is_flexible_period: bool,
+                         is_last_minute_period: bool) -> [BookingTypeRule]:
+    """Booking types which are allowed for a period with the given properties"""
+    return [t for t in booking_types if
+            (is_full_week or not t.is_full_week_only) and
+            (is_flexible_period or not t.requires_flexible_booking_period) and
+            (is_last_minute_period or not t.requires_last_minute_booking_period)]
 
 
 class BookingPage(Page):
@@ -274,6 +483,8 @@ class BookingPage(Page):
 
     def serve(self, request):
         from corroboree.booking.forms import BookingDateRangeForm, BookingRoomChoosingForm
+        from corroboree.booking.release import QUEUE_RETRY_SECONDS, release_window_open, reserve_rooms_in_turn
+        from corroboree.booking.reservations import reserve_rooms
         if not request.user.is_verified:
             raise PermissionDenied()  # should never happen barring admin shenangians
         else:
@@ -282,6 +493,7 @@ class BookingPage(Page):
                 return response
         member = request.user.member
         room_form = None
+        retry_seconds = None
         if member is None:
             return render(request, "booking/not_authorised.html", {
                 'page': self,
@@ -295,22 +507,20 @@ class BookingPage(Page):
                     member=member)
                 if room_form.is_valid():
                     # Put the booking in the database as a hold and redirect the user to finish it
-                    booking_record = BookingRecord(
-                        member=member,
-                        member_name_at_creation=member.full_name(),
-                        arrival_date=room_form.cleaned_data.get('arrival_date'),
-                        departure_date=room_form.cleaned_data.get('departure_date'),
-                        member_in_attendance=None,
-                        member_in_attendance_name_at_creation='',
-                        cost=None,
-                        payment_status=BookingRecord.BookingRecordPaymentStatus.NOT_ISSUED,
-                        status=BookingRecord.BookingRecordStatus.IN_PROGRESS
-                    )
-                    booking_record.save()
-                    rooms = room_form.cleaned_data.get('room_selection')
-                    booking_record.rooms.set(rooms)
-                    booking_record.calculate_booking_cart()
-                    return redirect('/my-bookings/edit/%s' % booking_record.pk)
+                    reserve = reserve_rooms_in_turn if release_window_open() else reserve_rooms
+                    try:
+                        booking_record = reserve(
+                            member=member,
+                            arrival_date=room_form.cleaned_data.get('arrival_date'),
+                            departure_date=room_form.cleaned_data.get('departure_date'),
+                            rooms=room_form.cleaned_data.get('room_selection'),
+                        )
+                    except ValidationError as e:  # someone else got there first, or it isn't their turn yet
+                        room_form.add_error(None, e)
+                        if e.code == 'queued':
+                            retry_seconds = QUEUE_RETRY_SECONDS
+                    else:
+                        return redirect('/my-bookings/edit/%s' % booking_record.pk)
                 # Preset the date values on the date form for consistency
                 arrival_date = room_form.data.get("arrival_date")
                 departure_date = room_form.data.get("departure_date")
@@ -329,6 +539,7 @@ class BookingPage(Page):
                 "page": self,
                 "date_form": date_form,
                 "room_form": room_form,
+                "retry_seconds": retry_seconds,
             })
 
 
@@ -387,23 +598,10 @@ class BookingPageUserSummary(RoutablePageMixin, Page):
             if response:
                 return response
             member = request.user.member
-            today = date.today()
-            bookings = BookingRecord.live_objects.filter(member__exact=member)
-            upcoming_bookings = bookings.filter(
-                departure_date__gt=today,
-                status__exact=BookingRecord.BookingRecordStatus.FINALISED
-            ).order_by('arrival_date')
-            in_progress_bookings = bookings.filter(
-                status__exact=BookingRecord.BookingRecordStatus.IN_PROGRESS
-            ).order_by('arrival_date')
-            submitted_bookings = bookings.filter(
-                status__exact=BookingRecord.BookingRecordStatus.SUBMITTED
-            ).order_by('arrival_date')
+            summary = member_booking_summary(member)
             return self.render(request, context_overrides={
                 'title': 'My Bookings',
-                'upcoming_bookings': upcoming_bookings,
-                'in_progress_bookings': in_progress_bookings,
-                'submitted_bookings': submitted_bookings,
+                **summary,
             })
 
     @path('edit/<int:booking_id>/')
@@ -598,22 +796,43 @@ def bookings_for_member_in_range(member: config.Member, arrival_date: date, depa
         arrival_date__gte=departure_date)
     return bookings
 
-def create_booking_cart_periods(start_date: date, end_date: date) -> [BookingCartPeriod]:
+def member_booking_summary(member: config.Member, today: date = None) -> {str: [BookingRecord]}:
+    """A member's in progress, submitted and upcoming bookings for the my bookings page, each ordered by arrival.
+
+    Fetched in one query with their member in attendance, plus one for their rooms and room types, then split up in
+    python so rendering them needs no further queries however many bookings there are"""
+    today = date.today() if today is None else today
+    status = BookingRecord.BookingRecordStatus
+    bookings = BookingRecord.live_objects.filter(member=member).exclude(
+        status=status.FINALISED, departure_date__lte=today
+    ).select_related('member_in_attendance').prefetch_related(
+        Prefetch('rooms', queryset=Room.objects.select_related('room_type'))
+    ).order_by('arrival_date')
+    summary = {'upcoming_bookings': [], 'in_progress_bookings': [], 'submitted_bookings': []}
+    for booking in bookings:
+        if booking.status == status.FINALISED:
+            summary['upcoming_bookings'].append(booking)
+        elif booking.status == status.IN_PROGRESS:
+            summary['in_progress_bookings'].append(booking)
+        elif booking.status == status.SUBMITTED:
+            summary['submitted_bookings'].append(booking)
+    return summary
+
+
+def create_booking_cart_periods(start_date: date, end_date: date, tables: PricingTables = None,
+                                window: BookingWindow = None) -> [BookingCartPeriod]:
+    """Split a stay into the periods it is priced by. Pass window to price it as it was at another moment"""
     # Info relating to classifying periods
-    conf = config.Config.objects.get()
-    week_start_day = conf.week_start_day
-    tod_rollover = conf.time_of_day_rollover
-    last_minute_weeks = conf.last_minute_booking_weeks + 1  # idiosyncratic ski club rules
-    flexible_booking_weeks = conf.flexible_booking_weeks + 1 # idiosyncratic ski club rules
-    aest_now = datetime.now(pytz.timezone('Australia/Sydney'))
-    compare_date = aest_now.date() if aest_now.time() >= tod_rollover else aest_now.date() - timedelta(days=1)
-    last_week_start = last_weekday_date(compare_date, week_start_day)
-    # And finally
-    last_minute_period_end = compare_date + timedelta(weeks=last_minute_weeks)
-    flexible_period_end = last_week_start + timedelta(weeks=flexible_booking_weeks)
+    if tables is None:
+        tables = pricing_tables()
+    week_start_day = tables.week_start_day
+    if window is None:
+        window = booking_window(tables)
+    last_minute_period_end = window.last_minute_period_end
+    flexible_period_end = window.flexible_period_end
     # Start making booking periods
     booking_cart_periods = []
-    seasons = conf.seasons_in_date_range(start_date, end_date)
+    seasons = tables.seasons_in_date_range(start_date, end_date)
     current_date = start_date
     while current_date < end_date:
         start_season = seasons_to_season_on_day(seasons, current_date)
@@ -643,13 +862,25 @@ def create_booking_cart_periods(start_date: date, end_date: date) -> [BookingCar
             end_season=end_season,
             is_full_week=is_full_week,
             is_flexible_period=is_flexible_period,
-            is_last_minute_period=is_last_minute_period
+            is_last_minute_period=is_last_minute_period,
+            tables=tables,
         )
         booking_cart_periods.append(booking_cart_period)
         current_date = end_period_date
     return booking_cart_periods
 
 
+def price_booking_cart(start_date: date, end_date: date, rooms: [Room], tables: PricingTables = None,
+                       window: BookingWindow = None) -> [BookingCartPeriod]:
+    """The periods of a stay in some rooms with their booking types and costs set. Periods no booking type fits are
+    left with both None"""
+    periods = create_booking_cart_periods(start_date, end_date, tables, window=window)
+    for period in periods:
+        period.set_rooms(rooms)
+        period.set_cost()
+    return periods
+
+
 
 
 def dates_to_weeks(arrival_date: date, departure_date: date, week_start_day=5) -> (int, int, int):
@@ -686,36 +917,42 @@ def seasons_to_season_on_day(seasons: [config.Season], day: date) -> config.Seas
 
 
 def check_season_rules(member: config.Member, arrival_date: datetime.date, departure_date: datetime.date, rooms: [config.Room]):
-    """ Given a member, a range of dates, and the rooms they would like to book for those dates. Validates the season rules which apply"""
-    conf = config.Config.objects.get()  # only valid for single config
+    """ Given a member, a range of dates, and the rooms they would like to book for those dates. Validates the season rules which apply
+
+    Rooms the member already holds are counted per night from RoomNight in one query, the new booking is added, and
+    the nights are summed per month. A night is occupied from arrival up to but not including departure."""
+    tables = pricing_tables()  # only valid for single config
     if member.share_number == 0:
         # Maintenance booking, allow anything
         return
-    elif departure_date <= date.today() + timedelta(weeks=conf.last_minute_booking_weeks):
+    elif departure_date <= date.today() + timedelta(weeks=tables.last_minute_booking_weeks):
         # Assuming the end date is already otherwise valid you can book anything 2 weeks out
         return
-    for start, end in date_range_to_month_ranges(arrival_date, departure_date):
-        room_start, room_end = daterange_of_a_in_b(arrival_date, departure_date, start, end)
-        overlapping_bookings = bookings_for_member_in_range(member, start, end)
-        occupancy_array = room_occupancy_array(start, end, rooms, room_start, room_end, overlapping_bookings)
-        season_in_month = conf.seasons_in_date_range(start, end)
-        # account for peak seasons
-        if season_in_month.count() == 1:
-            season_in_month = season_in_month.first()
-        else:
-            season_in_month = season_in_month.filter(season_is_peak=True).first()
-        sum_rooms = []
-        for day in range(0, len(occupancy_array[0])):
-            sum_rooms.append(sum([booked_rooms[day] for booked_rooms in occupancy_array]))
-            if season_in_month.max_monthly_room_weeks is not None:
-                if sum(sum_rooms) / 7 > season_in_month.max_monthly_room_weeks:
-                    raise ValidationError(
-                        'This booking exceeds the {max} room-weeks limit for {season} during {month}'.format(
-                            max=season_in_month.max_monthly_room_weeks,
-                            season=season_in_month.season_name,
-                            month=start.strftime('%B')
-                        )
-                    )
+    month_ranges = date_range_to_month_ranges(arrival_date, departure_date)
+    first_day = month_ranges[0][0]
+    last_day = month_ranges[-1][1] + timedelta(days=1)
+    rooms_per_night = [0] * (last_day - first_day).days
+    booked_nights = live_room_nights(
+        first_day, last_day, bookings=member.bookings(manager='live_objects').all()
+    ).values('date').annotate(num_rooms=Count('pk')).values_list('date', 'num_rooms')
+    for night, num_rooms in booked_nights:
+        rooms_per_night[(night - first_day).days] += num_rooms
+    for offset in range((arrival_date - first_day).days, (departure_date - first_day).days):
+        rooms_per_night[offset] += len(rooms)
+    for start, end in month_ranges:
+        season_in_month = seasons_to_season_on_day(tables.seasons_in_date_range(start, end), start)
+        if season_in_month.max_monthly_room_weeks is None:
+            continue
+        month_offset = (start - first_day).days
+        room_nights = sum(rooms_per_night[month_offset:month_offset + (end - start).days + 1])
+        if room_nights / 7 > season_in_month.max_monthly_room_weeks:
+            raise ValidationError(
+                'This booking exceeds the {max} room-weeks limit for {season} during {month}'.format(
+                    max=season_in_month.max_monthly_room_weeks,
+                    season=season_in_month.season_name,
+                    month=start.strftime('%B')
+                )
+            )
 
 
 def date_range_to_month_ranges(start: datetime.date, end: datetime.date) -> [(datetime.date, datetime.date)]:
@@ -738,52 +975,28 @@ def date_range_to_month_ranges(start: datetime.date, end: datetime.date) -> [(da
     return result
 
 
-def daterange_of_a_in_b(a_start: date, a_end: date, b_start: date, b_end: date) -> (date, date):
-    """Returns the subset of the range a which is in range b"""
-    overlap_start = max(a_start, b_start)
-    overlap_end = min(a_end, b_end)
-    return overlap_start, overlap_end
-
 def last_day_of_month(day: datetime.date):
     next_month = day.replace(day=28) + timedelta(days=4)
     return next_month - timedelta(days=next_month.day)
 
 
-def room_occupancy_array(start: date, end: date, rooms: [config.Room], room_start: date, room_end: date,
-                         other_bookings: [BookingRecord]):
-    """create a list of lists where the inner lists represent the number of rooms booked by that booking on that day"""
-    # on reflection this might be overkill and could probably just be a list of the sum of rooms booked on that day?
-    # TODO: length = (end - start).days is 1 day short of the full month, the last day of room_start -> end isn't 'occupied' but more nuance is needed to handle the difference between the booking ending or continuing past the month
-    array = []
-    length = (end - start).days + 1
-    start_delta = max(0, (room_start - start).days)
-    end_delta = max(0, (end - room_end).days + 1)  # last day is not occupied
-    array.append([0] * start_delta + [len(rooms)] * (length - (start_delta + end_delta)) + [0] * end_delta)
-    for this_booking in other_bookings:
-        num_rooms = this_booking.rooms.all().count()
-        # pad a list with the days vacant at start or end, so we know the rooms on each day
-        start_delta = max(0, (this_booking.arrival_date - start).days)
-        end_delta = max(0, (end - this_booking.departure_date).days + 1) # last day is not occupied
-        array.append([0] * start_delta + [num_rooms] * (length - (start_delta + end_delta)) + [0] * end_delta)
-    return array
+def live_room_nights(first_day: date, last_day: date, bookings: QuerySet[BookingRecord] = None) -> QuerySet[RoomNight]:
+    """RoomNights from first_day up to last_day which are held by live bookings
+
+    The bookings subquery is narrowed to those overlapping the range so it can use the booking date index rather
+    than visiting every live booking ever made."""
+    if bookings is None:
+        bookings = BookingRecord.live_objects.all()
+    return RoomNight.objects.filter(
+        date__gte=first_day,
+        date__lt=last_day,
+        booking__in=bookings.filter(departure_date__gt=first_day, arrival_date__lt=last_day),
+    )
 
 
 def booked_rooms(arrival_date, departure_date) -> [int]:
     """Returns a flat list of room numbers currently booked between dates"""
-    current_booking_records = BookingRecord.live_objects.filter(
-        departure_date__gt=date.today(),
-        arrival_date__lt=departure_date,
-    )
-    overlapping_bookings = current_booking_records.exclude(
-        arrival_date__gte=departure_date).exclude(
-        departure_date__lte=arrival_date,
-    )
-    booked_room_ids = overlapping_bookings.values_list('rooms__room_number', flat=True)
+    booked_nights = live_room_nights(arrival_date, departure_date)
+    booked_room_ids = booked_nights.values_list('room_id', flat=True).distinct()
     return booked_room_ids
 
-
-def last_weekday_date(date: date, weekday=5):
-    """Given a date and weekday, return the date of the last weekday (datetime ints [0-6])"""
-    date_day = date.weekday()
-    delta = timedelta((7 - (weekday - date_day)) % 7)
-    return date - delta
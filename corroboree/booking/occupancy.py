@@ -0,0 +1,78 @@
+from datetime import date, timedelta
+
+from django.db import transaction
+
+from corroboree.booking.models import BookingRecord, RoomNight
+
+BATCH_SIZE = 2000
+
+
+def nights_for(arrival_date: date, departure_date: date, room_numbers) -> {(int, date)}:
+    """The (room, night) pairs occupied by a stay, a night being the date it starts on"""
+    return {(room, arrival_date + timedelta(days=offset))
+            for room in room_numbers
+            for offset in range((departure_date - arrival_date).days)}
+
+
+def expected_room_nights(booking: BookingRecord) -> {(int, date)}:
+    if booking.status == BookingRecord.BookingRecordStatus.CANCELLED or booking.pk is None:
+        return set()
+    room_numbers = booking.rooms.values_list('room_number', flat=True)
+    return nights_for(booking.arrival_date, booking.departure_date, room_numbers)
+
+
+def sync_room_nights(booking: BookingRecord):
+    """Make the RoomNight rows for one booking match its current dates, rooms and status"""
+    with transaction.atomic():
+        expected = expected_room_nights(booking)
+        existing = {(room, night): pk for pk, room, night in
+                    RoomNight.objects.filter(booking=booking).values_list('pk', 'room_id', 'date')}
+        stale = [pk for key, pk in existing.items() if key not in expected]
+        if stale:
+            RoomNight.objects.filter(pk__in=stale).delete()
+        RoomNight.objects.bulk_create(
+            [RoomNight(booking=booking, room_id=room, date=night) for room, night in expected if
+             (room, night) not in existing],
+            batch_size=BATCH_SIZE,
+        )
+
+
+def release_room_nights(booking_ids):
+    """Drop the nights held by bookings which were cancelled without going through save(), e.g. queryset.update()"""
+    return RoomNight.objects.filter(booking_id__in=booking_ids).delete()[0]
+
+
+def all_expected_room_nights():
+    """Yield (booking_id, room, night) for every booking that is not cancelled"""
+    stays = BookingRecord.objects.exclude(
+        status=BookingRecord.BookingRecordStatus.CANCELLED
+    ).filter(rooms__isnull=False).values_list('pk', 'arrival_date', 'departure_date', 'rooms__room_number')
+    for booking_id, arrival_date, departure_date, room in stays.iterator(chunk_size=BATCH_SIZE):
+        for offset in range((departure_date - arrival_date).days):
+            yield booking_id, room, arrival_date + timedelta(days=offset)
+
+
+def rebuild_room_nights() -> int:
+    """Throw away and recreate every RoomNight from the booking records"""
+    created = 0
+    with transaction.atomic():
+        RoomNight.objects.all().delete()
+        batch = []
+        for booking_id, room, night in all_expected_room_nights():
+            batch.append(RoomNight(booking_id=booking_id, room_id=room, date=night))
+            if len(batch) >= BATCH_SIZE:
+                RoomNight.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        RoomNight.objects.bulk_create(batch)
+        created += len(batch)
+    return created
+
+
+def check_room_nights() -> ({(int, int, date)}, {(int, int, date)}):
+    """Compare the RoomNight table with the booking records.
+
+    Returns the (booking_id, room, night) rows which are missing and those which should not exist"""
+    expected = set(all_expected_room_nights())
+    actual = set(RoomNight.objects.values_list('booking_id', 'room_id', 'date').iterator(chunk_size=BATCH_SIZE))
+    return expected - actual, actual - expected
@@ -0,0 +1,82 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from corroboree.booking.models import OutboundEmail
+
+BATCH_SIZE = 50
+
+
+def due_emails() -> QuerySet[OutboundEmail]:
+    """Pending emails whose next attempt is due, oldest first"""
+    return OutboundEmail.objects.filter(
+        status=OutboundEmail.OutboundEmailStatus.PENDING,
+        next_attempt_at__lte=timezone.now(),
+    ).order_by('next_attempt_at', 'pk')
+
+
+def email_message(email: OutboundEmail, connection) -> EmailMultiAlternatives:
+    message = EmailMultiAlternatives(email.subject, email.body, email.from_email or None, email.recipients,
+                                     connection=connection)
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def record_failure(email: OutboundEmail, error: Exception):
+    """Schedule another attempt with exponential backoff, or give up after BOOKING_EMAIL_MAX_ATTEMPTS"""
+    email.attempts += 1
+    email.last_error = '{kind}: {error}'.format(kind=type(error).__name__, error=error)
+    if email.attempts >= settings.BOOKING_EMAIL_MAX_ATTEMPTS:
+        email.status = OutboundEmail.OutboundEmailStatus.FAILED
+    else:
+        delay = settings.BOOKING_EMAIL_RETRY_DELAY * 2 ** (email.attempts - 1)
+        email.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def drain_outbox(batch_size: int = BATCH_SIZE) -> {str: int}:
+    """Send every due email over a single mail connection and record how each went.
+
+    Batches are claimed with SELECT ... FOR UPDATE SKIP LOCKED so several senders can run at once without sending
+    the same email twice. An email is only marked sent after the mail server accepts it, so a crash between the two
+    can send it again. The connection is opened before the first email and reopened before the next after a failure.
+    If it can't be opened the mail server is taken to be down: what the batch managed is committed and the rest are
+    left pending for the next run. Returns counts of emails sent, to be retried, given up on and left pending"""
+    counts = {'sent': 0, 'retrying': 0, 'failed': 0, 'postponed': 0}
+    connection = get_connection()
+    closed = True
+    try:
+        while not counts['postponed']:
+            with transaction.atomic():
+                batch = list(due_emails().select_for_update(skip_locked=True)[:batch_size])
+                if not batch:
+                    break
+                for position, email in enumerate(batch):
+                    if closed:
+                        try:
+                            connection.open()
+                        except Exception:  # the server is down, keep the marks made so far and stop
+                            counts['postponed'] = len(batch) - position
+                            break
+                        closed = False
+                    try:
+                        connection.send_messages([email_message(email, connection)])
+                    except Exception as e:  # anything from the mail server, recorded and retried
+                        record_failure(email, e)
+                        counts['failed' if email.status == email.OutboundEmailStatus.FAILED else 'retrying'] += 1
+                        connection.close()  # the connection may be broken, start afresh for the next email
+                        closed = True
+                    else:
+                        email.status = email.OutboundEmailStatus.SENT
+                        email.attempts += 1
+                        email.sent_at = timezone.now()
+                        email.save(update_fields=['status', 'attempts', 'sent_at'])
+                        counts['sent'] += 1
+    finally:
+        connection.close()
+    return counts
@@ -0,0 +1,258 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from corroboree.booking.expiry import bulk_update_status
+from corroboree.booking.models import BookingRecord, PaymentCapture, PayPalWebhookEvent
+from corroboree.booking.paypal import WEBHOOK_HEADERS, PaymentGatewayError, payment_gateway
+
+BATCH_SIZE = 100
+
+CAPTURE_COMPLETED = 'PAYMENT.CAPTURE.COMPLETED'
+CAPTURE_DENIED = 'PAYMENT.CAPTURE.DENIED'
+CAPTURE_REFUNDED = 'PAYMENT.CAPTURE.REFUNDED'
+CAPTURE_REVERSED = 'PAYMENT.CAPTURE.REVERSED'
+
+
+# Capturing payments
+#
+# The browser asks for an approved order to be captured once the member has paid, and may ask again if it retries or
+# the button is clicked twice. Each order gets one PaymentCapture, taken before PayPal is called. Whoever takes it
+# makes the only capture call, the others are told straight away that the payment is still being processed. PayPal's
+# response is stored on the capture as soon as it arrives, then the booking becoming paid and finalised, its
+# confirmation email in the outbox and the capture being completed are committed together. If finalising fails the
+# next attempt finalises from the stored response rather than asking PayPal again.
+
+def capture_expiry() -> timedelta:
+    """How long a capture can be in progress before it is assumed its worker died and another may take it over"""
+    return timedelta(seconds=2 * (settings.PAYPAL_CONNECT_TIMEOUT + settings.PAYPAL_READ_TIMEOUT))
+
+
+def claim_capture(order_id: str) -> (PaymentCapture, bool):
+    """The order's capture and whether this request is the one to make it"""
+    try:
+        capture, created = PaymentCapture.objects.get_or_create(order_id=order_id)
+    except IntegrityError:  # captured twice at once, the other request has it
+        return PaymentCapture.objects.get(order_id=order_id), False
+    if created:
+        return capture, True
+    stale = timezone.now() - capture_expiry()
+    taken_over = PaymentCapture.objects.filter(
+        pk=capture.pk,
+        status=PaymentCapture.PaymentCaptureStatus.IN_PROGRESS,
+        updated__lt=stale,
+    ).update(updated=timezone.now())
+    return capture, bool(taken_over)
+
+
+def send_confirmation_email(booking: BookingRecord):
+    booking.send_related_email(
+        subject='Neige Booking Confirmation: {start} - {end}'.format(
+            start=booking.arrival_date,
+            end=booking.departure_date,
+        ),
+        email_text='The following booking has been confirmed and paid for:'
+    )  # TODO: this text etc should probably be in the configuration
+
+
+def store_capture_response(capture: PaymentCapture, response: dict):
+    """Keep PayPal's answer on its own, so it survives finalising the booking failing"""
+    capture.status = PaymentCapture.PaymentCaptureStatus.CAPTURED
+    capture.response = response
+    capture.save(update_fields=['status', 'response', 'updated'])
+
+
+def finalise_paid_booking(capture: PaymentCapture) -> BookingRecord:
+    """Record a capture PayPal has made against its booking, in one transaction with one save of the booking.
+
+    Does nothing for a capture another request has already completed"""
+    with transaction.atomic():
+        capture = PaymentCapture.objects.select_for_update().get(pk=capture.pk)
+        if capture.status == PaymentCapture.PaymentCaptureStatus.COMPLETED:
+            return capture.booking
+        paypal_capture = capture.response['purchase_units'][0]['payments']['captures'][0]
+        booking = BookingRecord.objects.select_for_update().get(id=paypal_capture['custom_id'])
+        booking.payment_status = BookingRecord.BookingRecordPaymentStatus.PAID
+        booking.paypal_transaction_id = paypal_capture['id']
+        booking.status = BookingRecord.BookingRecordStatus.FINALISED
+        booking.save(update_fields=['payment_status', 'paypal_transaction_id', 'status', 'last_updated'])
+        send_confirmation_email(booking)
+        capture.booking = booking
+        capture.status = PaymentCapture.PaymentCaptureStatus.COMPLETED
+        capture.save()
+    return booking
+
+
+def capture_payment(order_id: str) -> dict:
+    """Capture an approved PayPal order and finalise its booking, at most once however often it is asked.
+
+    Returns PayPal's capture response, the stored one for an order already captured. Raises PaymentGatewayError if
+    PayPal refused or couldn't be reached, after which the member may try again, or with status 409 if another request
+    is still capturing the order. The order id doubles as PayPal's request id, so a capture taken over from a dead
+    worker gets PayPal's original answer instead of capturing twice"""
+    capture, claimed = claim_capture(order_id)
+    if not claimed:
+        if capture.status == PaymentCapture.PaymentCaptureStatus.IN_PROGRESS:
+            raise PaymentGatewayError('The payment is still being processed, please check your bookings shortly', 409)
+        if capture.status == PaymentCapture.PaymentCaptureStatus.CAPTURED:  # captured but not yet finalised
+            finalise_paid_booking(capture)
+        return capture.response
+    try:
+        response = payment_gateway().capture_order(order_id, request_id=order_id)
+    except PaymentGatewayError:
+        capture.delete()  # nothing was captured, let the next attempt start afresh
+        raise
+    store_capture_response(capture, response)
+    finalise_paid_booking(capture)
+    return response
+
+
+# Webhook reconciliation
+#
+# PayPal notifies the webhook of every capture, whether or not the member's browser got as far as /api/capture-order/,
+# and of refunds and reversals made on PayPal's side. The webhook only stores each event. reconcile-payments then
+# takes pending events a batch at a time, has PayPal verify each, matches them to bookings by transaction id, or for
+# captures the browser never reported by the booking id PayPal echoes back as custom_id, and applies the whole batch
+# with one bulk update.
+
+def record_webhook_event(headers, event: dict) -> bool:
+    """Store an event as PayPal sent it. Returns whether it was new, PayPal redelivers until it is acknowledged"""
+    try:
+        with transaction.atomic():
+            PayPalWebhookEvent.objects.create(
+                event_id=event['id'],
+                event_type=event['event_type'],
+                headers={header: headers.get(header, '') for header in WEBHOOK_HEADERS},
+                event=event,
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def pending_events() -> QuerySet[PayPalWebhookEvent]:
+    return PayPalWebhookEvent.objects.filter(
+        outcome=PayPalWebhookEvent.PayPalWebhookEventOutcome.PENDING
+    ).order_by('received', 'pk')
+
+
+def event_capture(event: dict) -> (str, str):
+    """The capture id and booking id an event is about, either of which may be blank"""
+    resource = event.get('resource') or {}
+    if event.get('event_type') in (CAPTURE_REFUNDED, CAPTURE_REVERSED):  # the resource is a refund of the capture
+        parents = [link['href'] for link in resource.get('links', []) if link.get('rel') == 'up']
+        capture_id = parents[0].rstrip('/').rsplit('/', 1)[-1] if parents else ''
+    else:
+        capture_id = resource.get('id', '')
+    return capture_id, str(resource.get('custom_id', ''))
+
+
+def apply_event(event_type: str, booking: BookingRecord | None, capture_id: str) -> (str, str):
+    """Change a booking's payment in memory as an event says. Returns the event's outcome and a note for admins"""
+    outcome = PayPalWebhookEvent.PayPalWebhookEventOutcome
+    payment_status = BookingRecord.BookingRecordPaymentStatus
+    if booking is None:
+        return outcome.IGNORED, 'No booking matches the event'
+    paid_by_other_capture = (booking.payment_status == payment_status.PAID and
+                             booking.paypal_transaction_id != capture_id)
+    if event_type == CAPTURE_COMPLETED:
+        if paid_by_other_capture:
+            return outcome.IGNORED, 'Already paid by capture %s, one of them needs refunding' % (
+                booking.paypal_transaction_id)
+        if booking.payment_status == payment_status.PAID:
+            return outcome.IGNORED, 'Already recorded'
+        booking.payment_status = payment_status.PAID
+        booking.paypal_transaction_id = capture_id
+        if booking.status == BookingRecord.BookingRecordStatus.CANCELLED:
+            return outcome.APPLIED, 'Paid after its hold expired and it was cancelled, rebook or refund it'
+        return outcome.APPLIED, ''
+    if event_type == CAPTURE_DENIED:
+        if paid_by_other_capture:
+            return outcome.IGNORED, 'Paid by another capture'
+        booking.payment_status = payment_status.FAILED
+        if booking.status == BookingRecord.BookingRecordStatus.FINALISED:
+            return outcome.APPLIED, 'Payment denied after the booking was finalised'
+        return outcome.APPLIED, ''
+    if event_type in (CAPTURE_REFUNDED, CAPTURE_REVERSED):
+        if booking.paypal_transaction_id != capture_id:
+            return outcome.IGNORED, 'Refunds capture %s, not %s which paid for the booking' % (
+                capture_id, booking.paypal_transaction_id or 'any capture')
+        booking.payment_status = payment_status.REFUNDED
+        return outcome.APPLIED, ''
+    return outcome.IGNORED, 'Not an event reconcile-payments acts on'
+
+
+def verified_events(events: [PayPalWebhookEvent], now) -> [PayPalWebhookEvent]:
+    """Have PayPal verify each event, marking those it doesn't confirm rejected. Returns the rest"""
+    gateway = payment_gateway()
+    verified = []
+    for event in events:
+        event.processed_at = now
+        if gateway.verify_webhook_event(event.headers, event.event):
+            verified.append(event)
+        else:
+            event.outcome = PayPalWebhookEvent.PayPalWebhookEventOutcome.REJECTED
+            event.detail = 'PayPal did not confirm sending this event'
+    return verified
+
+
+def reconcile_batch(events: [PayPalWebhookEvent]) -> [BookingRecord]:
+    """Verify and apply a batch of events in the order they were received. Returns the bookings to finalise.
+
+    Every event is verified before any booking is locked, so a slow PayPal holds up only the claimed events and never
+    a member's capture or the expiry of holds. The bookings are then locked until the caller's transaction commits"""
+    now = timezone.now()
+    verified = verified_events(events, now)
+    captures = {event.pk: event_capture(event.event) for event in verified}
+    bookings = BookingRecord.objects.select_for_update().filter(
+        Q(paypal_transaction_id__in={capture_id for capture_id, _ in captures.values() if capture_id}) |
+        Q(pk__in={booking_id for _, booking_id in captures.values() if booking_id.isdigit()})
+    ) if verified else []
+    by_id = {str(booking.pk): booking for booking in bookings}
+    by_transaction = {booking.paypal_transaction_id: booking for booking in by_id.values()
+                      if booking.paypal_transaction_id}
+    changed = {}
+    finalise = {}
+    for event in verified:
+        capture_id, booking_id = captures[event.pk]
+        booking = by_transaction.get(capture_id) or by_id.get(booking_id)
+        event.booking = booking
+        event.outcome, event.detail = apply_event(event.event_type, booking, capture_id)
+        if event.outcome != PayPalWebhookEvent.PayPalWebhookEventOutcome.APPLIED:
+            continue
+        booking.last_updated = now
+        changed[booking.pk] = booking
+        by_transaction[booking.paypal_transaction_id] = booking
+        if event.event_type == CAPTURE_COMPLETED and booking.status in (BookingRecord.BookingRecordStatus.IN_PROGRESS,
+                                                                        BookingRecord.BookingRecordStatus.SUBMITTED):
+            finalise[booking.pk] = booking
+    BookingRecord.objects.bulk_update(changed.values(), ['payment_status', 'paypal_transaction_id', 'last_updated'])
+    PayPalWebhookEvent.objects.bulk_update(events, ['outcome', 'detail', 'booking', 'processed_at'])
+    return list(finalise.values())
+
+
+def reconcile_webhook_events(batch_size: int = BATCH_SIZE) -> {str: int}:
+    """Apply every pending webhook event, a batch per transaction.
+
+    Batches are claimed with SELECT ... FOR UPDATE SKIP LOCKED like the outbox, so overlapping runs don't apply an event
+    twice. Bookings paid for by an event are finalised with one bulk_update_status per batch and sent their
+    confirmation. If PayPal can't be reached to verify an event the batch is left pending and PaymentGatewayError
+    raised. Returns how many events were applied, ignored and rejected"""
+    counts = {'applied': 0, 'ignored': 0, 'rejected': 0}
+    while True:
+        with transaction.atomic():
+            events = list(pending_events().select_for_update(skip_locked=True)[:batch_size])
+            if not events:
+                break
+            finalise = reconcile_batch(events)
+            bulk_update_status(BookingRecord.objects.filter(pk__in=[booking.pk for booking in finalise]),
+                               BookingRecord.BookingRecordStatus.FINALISED)
+            for booking in finalise:
+                if booking.member_in_attendance_id is not None:
+                    send_confirmation_email(booking)
+            for event in events:
+                counts[event.get_outcome_display().lower()] += 1
+    return counts
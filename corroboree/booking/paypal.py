@@ -0,0 +1,276 @@
+import json
+import logging
+import time
+import uuid
+from functools import cache
+
+import requests
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+from django.utils.module_loading import import_string
+from paypalserversdk.api_helper import APIHelper
+from paypalserversdk.exceptions.api_exception import APIException
+from paypalserversdk.exceptions.error_exception import ErrorException
+from paypalserversdk.http.auth.o_auth_2 import ClientCredentialsAuthCredentials
+from paypalserversdk.logging.configuration.api_logging_configuration import LoggingConfiguration, \
+    RequestLoggingConfiguration, ResponseLoggingConfiguration
+from paypalserversdk.models.amount_with_breakdown import AmountWithBreakdown
+from paypalserversdk.models.checkout_payment_intent import CheckoutPaymentIntent
+from paypalserversdk.models.o_auth_token import OAuthToken
+from paypalserversdk.models.order_request import OrderRequest
+from paypalserversdk.models.pay_pal_experience_user_action import PayPalExperienceUserAction
+from paypalserversdk.models.pay_pal_wallet import PayPalWallet
+from paypalserversdk.models.pay_pal_wallet_experience_context import PayPalWalletExperienceContext
+from paypalserversdk.models.payee import Payee
+from paypalserversdk.models.payment_source import PaymentSource
+from paypalserversdk.models.purchase_unit_request import PurchaseUnitRequest
+from paypalserversdk.models.shipping_preference import ShippingPreference
+from paypalserversdk.paypalserversdk_client import Environment, PaypalserversdkClient
+
+TOKEN_KEY = 'paypal-oauth-token:{client_id}'
+TOKEN_EXPIRY_MARGIN = 60  # seconds before PayPal's expiry a shared token stops being handed out
+TOKEN_LOCK_KEY = 'paypal-oauth-token-lock:{client_id}'
+TOKEN_POLL_INTERVAL = 0.1
+# Sent with every webhook event, PayPal checks them against the event to confirm it was the sender
+WEBHOOK_HEADERS = ['PAYPAL-AUTH-ALGO', 'PAYPAL-CERT-URL', 'PAYPAL-TRANSMISSION-ID', 'PAYPAL-TRANSMISSION-SIG',
+                   'PAYPAL-TRANSMISSION-TIME']
+FAKE_ORDER_KEY = 'paypal-fake-order:{order_id}'
+FAKE_CAPTURE_KEY = 'paypal-fake-capture:{order_id}'
+FAKE_ORDER_SECONDS = 3 * 60 * 60  # PayPal forgets unapproved orders after three hours
+
+
+class PaymentGatewayError(Exception):
+    """A call to the payment gateway failed, with the message and HTTP status to pass on to the browser"""
+
+    def __init__(self, message: str, status: int = 502):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+# Gateways
+#
+# Views talk to PayPal through payment_gateway(), which builds the class named by settings.PAYPAL_GATEWAY the first
+# time it is used in a process and then keeps it. Importing this module costs nothing, so management commands that
+# never take a payment never build a client. A gateway has create_order(booking, return_url, cancel_url) and
+# capture_order(order_id, request_id=None), both returning PayPal's JSON response as a dict or raising
+# PaymentGatewayError, and verify_webhook_event(headers, event) saying whether PayPal sent a webhook event.
+
+@cache
+def payment_gateway():
+    """The process wide payment gateway, see settings.PAYPAL_GATEWAY"""
+    return import_string(settings.PAYPAL_GATEWAY)()
+
+
+def shared_oauth_token(last_token: OAuthToken, auth) -> OAuthToken:
+    """OAuth token provider for the SDK sharing one access token between all workers through the cache.
+
+    The SDK only asks for a token when it has none or its own has expired, so each worker reads the cache about once
+    per token lifetime. Only the worker holding the cache lock goes to PayPal for a new one, the others wait for it to
+    be shared, or fetch their own if it doesn't turn up within a request timeout"""
+    key = TOKEN_KEY.format(client_id=settings.PAYPAL_CLIENT_ID)
+    token = shared_cache.get(key)
+    if token is not None:
+        return OAuthToken.from_dictionary(token)
+    lock_seconds = settings.PAYPAL_CONNECT_TIMEOUT + settings.PAYPAL_READ_TIMEOUT
+    lock = TOKEN_LOCK_KEY.format(client_id=settings.PAYPAL_CLIENT_ID)
+    locked = shared_cache.add(lock, True, lock_seconds)
+    if not locked:
+        deadline = time.monotonic() + lock_seconds
+        while time.monotonic() < deadline:
+            time.sleep(TOKEN_POLL_INTERVAL)
+            token = shared_cache.get(key)
+            if token is not None:
+                return OAuthToken.from_dictionary(token)
+    try:
+        token = auth.fetch_token()
+        lifetime = int(getattr(token, 'expires_in', 0)) - TOKEN_EXPIRY_MARGIN
+        if lifetime > 0:
+            shared_cache.set(key, APIHelper.to_dictionary(token), lifetime)
+    finally:
+        if locked:
+            shared_cache.delete(lock)
+    return token
+
+
+def order_request(booking, return_url: str, cancel_url: str) -> OrderRequest:
+    return OrderRequest(
+        intent=CheckoutPaymentIntent.CAPTURE,
+        purchase_units=[
+            PurchaseUnitRequest(
+                amount=AmountWithBreakdown(
+                    currency_code='AUD',
+                    value=str(booking.cost)
+                ),
+                custom_id=booking.id,
+                description='Neigejindi booking: %s' % booking.id,
+                payee=Payee(
+                    email_address=settings.PAYPAL_MERCHANT_EMAIL,
+                )
+            )
+        ],
+        payment_source=PaymentSource(
+            paypal=PayPalWallet(
+                experience_context=PayPalWalletExperienceContext(
+                    shipping_preference=ShippingPreference.NO_SHIPPING,
+                    return_url=return_url,
+                    cancel_url=cancel_url,
+                    brand_name='Neige Investments PTY Limited',
+                    user_action=PayPalExperienceUserAction.PAY_NOW,
+                    # payment_method_preference=PayeePaymentMethodPreference.UNRESTRICTED,
+                )
+            )
+        )
+    )
+
+
+class PayPalGateway:
+    """PayPal's Orders API through one SDK client.
+
+    The client keeps a single requests session, so calls reuse a kept-alive connection to PayPal rather than doing a
+    TLS handshake each, and an OAuth token until it expires, see shared_oauth_token. Calls give up after
+    PAYPAL_CONNECT_TIMEOUT seconds connecting or PAYPAL_READ_TIMEOUT seconds waiting for a response"""
+
+    def __init__(self):
+        self.client = PaypalserversdkClient(
+            client_credentials_auth_credentials=ClientCredentialsAuthCredentials(
+                o_auth_client_id=settings.PAYPAL_CLIENT_ID,
+                o_auth_client_secret=settings.PAYPAL_CLIENT_SECRET,
+                o_auth_token_provider=shared_oauth_token,
+            ),
+            environment=Environment.SANDBOX if settings.PAYPAL_SANDBOX else Environment.PRODUCTION,
+            timeout=(settings.PAYPAL_CONNECT_TIMEOUT, settings.PAYPAL_READ_TIMEOUT),
+            logging_configuration=LoggingConfiguration(
+                log_level=logging.INFO,
+                request_logging_config=RequestLoggingConfiguration(
+                    log_body=True
+                ),
+                response_logging_config=ResponseLoggingConfiguration(
+                    log_headers=True,
+                    log_body=True,
+                )
+            )
+        )
+
+    def create_order(self, booking, return_url: str, cancel_url: str) -> dict:
+        """Create an order for a booking's cost, see https://developer.paypal.com/docs/api/orders/v2/#orders_create"""
+        return self.call(self.client.orders.orders_create, {
+            'body': order_request(booking, return_url, cancel_url),
+            # 'paypal_request_id': request_id,
+            'prefer': 'return=minimal'
+        })
+
+    def capture_order(self, order_id: str, request_id: str = None) -> dict:
+        """Capture an approved order, see https://developer.paypal.com/docs/api/orders/v2/#orders_capture
+
+        PayPal answers a repeat of a request_id it has already captured with that capture rather than a new one"""
+        collect = {
+            'id': order_id,
+            'prefer': 'return=minimal'
+        }
+        if request_id is not None:
+            collect['paypal_request_id'] = request_id
+        return self.call(self.client.orders.orders_capture, collect)
+
+    def verify_webhook_event(self, headers: dict, event: dict) -> bool:
+        """Ask PayPal whether it sent an event to PAYPAL_WEBHOOK_ID, see
+        https://developer.paypal.com/docs/api/webhooks/v1/#verify-webhook-signature_post
+
+        The SDK has no webhooks API so this goes over the SDK client's session with its OAuth token"""
+        try:
+            token = shared_oauth_token(None, self.client.oauth_2)
+            response = self.client.config.http_client.session.post(
+                self.client.config.get_base_uri() + '/v1/notifications/verify-webhook-signature',
+                json={
+                    'auth_algo': headers.get('PAYPAL-AUTH-ALGO'),
+                    'cert_url': headers.get('PAYPAL-CERT-URL'),
+                    'transmission_id': headers.get('PAYPAL-TRANSMISSION-ID'),
+                    'transmission_sig': headers.get('PAYPAL-TRANSMISSION-SIG'),
+                    'transmission_time': headers.get('PAYPAL-TRANSMISSION-TIME'),
+                    'webhook_id': settings.PAYPAL_WEBHOOK_ID,
+                    'webhook_event': event,
+                },
+                headers={'Authorization': 'Bearer %s' % token.access_token},
+                timeout=(settings.PAYPAL_CONNECT_TIMEOUT, settings.PAYPAL_READ_TIMEOUT),
+            )
+            response.raise_for_status()
+        except APIException as e:
+            raise PaymentGatewayError(e.reason, e.response_code) from e
+        except requests.RequestException as e:
+            raise PaymentGatewayError('Could not verify the webhook event with PayPal: %s' % e) from e
+        return response.json().get('verification_status') == 'SUCCESS'
+
+    @staticmethod
+    def call(endpoint, collect) -> dict:
+        try:
+            return json.loads(endpoint(collect).text)
+        except ErrorException as e:
+            raise PaymentGatewayError(e.message, e.response_code) from e
+        except APIException as e:
+            raise PaymentGatewayError(e.reason, e.response_code) from e
+        except requests.Timeout as e:
+            raise PaymentGatewayError('PayPal took too long to respond, please try again', 504) from e
+        except requests.RequestException as e:
+            raise PaymentGatewayError('Could not reach PayPal, please try again', 502) from e
+
+
+class FakeGateway:
+    """Stands in for PayPal in development, tests and load tests without any network calls.
+
+    Orders are kept in the shared cache so every worker can capture them and are approved as soon as they are created.
+    Responses have the same shape as PayPal's, capturing an order twice fails like PayPal does unless the request id is
+    repeated, and each call sleeps PAYPAL_FAKE_LATENCY seconds to stand in for the round trip"""
+
+    def create_order(self, booking, return_url: str, cancel_url: str) -> dict:
+        self.wait()
+        order_id = uuid.uuid4().hex[:17].upper()
+        shared_cache.set(FAKE_ORDER_KEY.format(order_id=order_id), {
+            'custom_id': str(booking.id),
+            'value': str(booking.cost),
+        }, FAKE_ORDER_SECONDS)
+        return {
+            'id': order_id,
+            'status': 'PAYER_ACTION_REQUIRED',
+            'links': [{'href': return_url, 'rel': 'payer-action', 'method': 'GET'}],
+        }
+
+    def capture_order(self, order_id: str, request_id: str = None) -> dict:
+        self.wait()
+        order = shared_cache.get(FAKE_ORDER_KEY.format(order_id=order_id))
+        if order is None:
+            raise PaymentGatewayError('RESOURCE_NOT_FOUND', 404)
+        response = self.capture_response(order_id, order)
+        if not shared_cache.add(FAKE_CAPTURE_KEY.format(order_id=order_id), (request_id, response), FAKE_ORDER_SECONDS):
+            captured_request_id, captured = shared_cache.get(FAKE_CAPTURE_KEY.format(order_id=order_id))
+            if request_id is None or request_id != captured_request_id:
+                raise PaymentGatewayError('ORDER_ALREADY_CAPTURED', 422)
+            return captured
+        return response
+
+    @staticmethod
+    def capture_response(order_id: str, order: dict) -> dict:
+        return {
+            'id': order_id,
+            'status': 'COMPLETED',
+            'purchase_units': [{
+                'payments': {
+                    'captures': [{
+                        'id': uuid.uuid4().hex[:17].upper(),
+                        'status': 'COMPLETED',
+                        'custom_id': order['custom_id'],
+                        'amount': {'currency_code': 'AUD', 'value': order['value']},
+                    }],
+                },
+            }],
+        }
+
+    def verify_webhook_event(self, headers: dict, event: dict) -> bool:
+        """Any event that came with PayPal's transmission headers, recorded events replayed by replay-paypal-events
+        keep theirs"""
+        self.wait()
+        return all(headers.get(header) for header in WEBHOOK_HEADERS)
+
+    @staticmethod
+    def wait():
+        if settings.PAYPAL_FAKE_LATENCY:
+            time.sleep(settings.PAYPAL_FAKE_LATENCY)
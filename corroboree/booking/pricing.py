@@ -0,0 +1,302 @@
+import threading
+import uuid
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+import pytz
+from django.core.cache import cache
+from django.utils import timezone
+
+from corroboree.config import models as config
+
+PRICING_GENERATION_KEY = 'pricing:generation'
+BOOKING_TIMEZONE = pytz.timezone('Australia/Sydney')
+
+
+@dataclass(frozen=True)
+class BookingTypeRule:
+    """An immutable copy of a BookingType with its banned rooms as room numbers"""
+    pk: int
+    booking_type_name: str
+    rate: Decimal
+    is_full_week_only: bool
+    sets_weekly_rate_cap: bool
+    requires_flexible_booking_period: bool
+    requires_last_minute_booking_period: bool
+    is_flat_rate: bool
+    banned_rooms: frozenset
+    minimum_rooms: int
+    priority_rank: int
+
+    def __str__(self):
+        return self.booking_type_name
+
+
+@dataclass(frozen=True)
+class SeasonRule:
+    """An immutable copy of a Season with its booking types ordered by priority"""
+    pk: int
+    season_name: str
+    max_monthly_room_weeks: int | None
+    start_month: int
+    end_month: int
+    season_is_peak: bool
+    requires_strict_weeks: bool
+    booking_types: tuple
+
+    def __str__(self):
+        return self.season_name
+
+    date_is_in_season = config.Season.date_is_in_season
+
+    def weekly_rate_cap(self) -> BookingTypeRule | None:
+        """The booking type setting the weekly rate cap, mirroring BookingType.objects.get(sets_weekly_rate_cap=True)"""
+        capping_types = [t for t in self.booking_types if t.sets_weekly_rate_cap]
+        if len(capping_types) > 1:
+            raise config.BookingType.MultipleObjectsReturned()
+        return capping_types[0] if capping_types else None
+
+
+@dataclass(frozen=True)
+class PricingTables:
+    """Everything needed to price a booking, loaded from the config in one go so pricing needs no queries.
+
+    This is the process wide snapshot of the Config: anything that only reads the config should get it from
+    pricing_tables() rather than querying Config and its snippets itself"""
+    week_start_day: int
+    time_of_day_rollover: time
+    max_weeks_till_booking: int
+    flexible_booking_weeks: int
+    last_minute_booking_weeks: int
+    room_numbers: frozenset
+    rooms: tuple  # Room instances ordered by number, with their room types loaded
+    seasons: tuple
+
+    def seasons_in_date_range(self, start_date: date, end_date: date) -> [SeasonRule]:
+        """Python equivalent of Config.seasons_in_date_range"""
+        start_month = start_date.month
+        end_month = end_date.month
+        seasons = []
+        for s in self.seasons:
+            wraps = s.start_month > s.end_month
+            if start_month <= end_month:
+                if not wraps and (s.start_month > end_month or s.end_month < start_month):
+                    continue
+                if wraps and (s.end_month < start_month and s.start_month > end_month):
+                    continue
+            else:
+                if not wraps and (s.start_month > end_month and s.end_month < start_month):
+                    continue
+            seasons.append(s)
+        return seasons
+
+
+@dataclass(frozen=True)
+class BookingCartLine:
+    """One priced period of a booking as it was quoted, kept in BookingRecord.booking_cart so the booking keeps its
+    price and breakdown when booking types change later"""
+    start_date: date
+    end_date: date
+    booking_type: int | None  # the BookingType's pk
+    booking_type_name: str
+    rate: Decimal
+    rooms: tuple  # room numbers
+    cost: Decimal
+
+    def __str__(self):
+        return (f"Period: {self.start_date} - {self.end_date}, "
+                f"Rate: {self.booking_type_name}, Rooms: {len(self.rooms)}, "
+                f"Cost ${self.cost}")
+
+    @classmethod
+    def from_period(cls, period) -> 'BookingCartLine':
+        """The line for a BookingCartPeriod once set_cost has priced it"""
+        return cls(
+            start_date=period.start_date,
+            end_date=period.end_date,
+            booking_type=period.booking_type.pk,
+            booking_type_name=period.booking_type.booking_type_name,
+            rate=period.booking_type.rate,
+            rooms=tuple(sorted(period.room_numbers)),
+            cost=Decimal(period.cost),
+        )
+
+    @classmethod
+    def from_json(cls, line: dict) -> 'BookingCartLine':
+        return cls(
+            start_date=date.fromisoformat(line['start_date']),
+            end_date=date.fromisoformat(line['end_date']),
+            booking_type=line['booking_type'],
+            booking_type_name=line['booking_type_name'],
+            rate=Decimal(line['rate']),
+            rooms=tuple(line['rooms']),
+            cost=Decimal(line['cost']),
+        )
+
+    def to_json(self) -> dict:
+        return {
+            'start_date': self.start_date.isoformat(),
+            'end_date': self.end_date.isoformat(),
+            'booking_type': self.booking_type,
+            'booking_type_name': self.booking_type_name,
+            'rate': str(self.rate),
+            'rooms': list(self.rooms),
+            'cost': str(self.cost),
+        }
+
+
+@dataclass(frozen=True)
+class BookingWindow:
+    """The dates bookings can currently be made for and priced against, as of the last rollover.
+
+    These only change when time_of_day_rollover passes, so one window is computed per rollover and shared by the
+    date form, the booking cart and the release machinery, see booking_window()"""
+    compare_date: date  # today, or yesterday before the rollover
+    last_week_start: date
+    last_minute_period_end: date
+    flexible_period_end: date
+    max_arrival_date: date
+    max_departure_date: date
+    last_release: datetime  # when the most recently released week opened
+    next_release: datetime
+    valid_until: datetime  # the next rollover, when this window must be recomputed
+
+    @classmethod
+    def at(cls, tables: PricingTables, now: datetime) -> 'BookingWindow':
+        aest_now = now.astimezone(BOOKING_TIMEZONE)
+        rollover = tables.time_of_day_rollover
+        compare_date = aest_now.date() if aest_now.time() >= rollover else aest_now.date() - timedelta(days=1)
+        last_week_start = last_weekday_date(compare_date, tables.week_start_day)
+        return cls(
+            compare_date=compare_date,
+            last_week_start=last_week_start,
+            # idiosyncratic ski club rules, the periods run a week longer than configured
+            last_minute_period_end=compare_date + timedelta(weeks=tables.last_minute_booking_weeks + 1),
+            flexible_period_end=last_week_start + timedelta(weeks=tables.flexible_booking_weeks + 1),
+            max_arrival_date=last_week_start + timedelta(weeks=tables.max_weeks_till_booking),
+            max_departure_date=last_week_start + timedelta(weeks=tables.max_weeks_till_booking + 1),
+            last_release=rollover_instant(last_week_start, rollover),
+            next_release=rollover_instant(last_week_start + timedelta(weeks=1), rollover),
+            valid_until=rollover_instant(compare_date + timedelta(days=1), rollover),
+        )
+
+
+def rollover_instant(day: date, rollover: time) -> datetime:
+    return BOOKING_TIMEZONE.localize(datetime.combine(day, rollover))
+
+
+def last_weekday_date(date: date, weekday=5):
+    """Given a date and weekday, return the date of the last weekday (datetime ints [0-6])"""
+    date_day = date.weekday()
+    delta = timedelta((7 - (weekday - date_day)) % 7)
+    return date - delta
+
+
+def load_pricing_tables(conf: config.Config = None) -> PricingTables:
+    """Read the Config -> Season -> BookingType -> banned rooms graph into PricingTables"""
+    if conf is None:
+        conf = config.Config.objects.get()
+    seasons = []
+    for season in conf.seasons.prefetch_related('booking_types__banned_rooms').order_by('pk'):
+        booking_types = sorted(
+            (booking_type_rule(t) for t in season.booking_types.all()),
+            key=lambda t: (t.priority_rank, t.pk),
+        )
+        seasons.append(SeasonRule(
+            pk=season.pk,
+            season_name=season.season_name,
+            max_monthly_room_weeks=season.max_monthly_room_weeks,
+            start_month=season.start_month,
+            end_month=season.end_month,
+            season_is_peak=season.season_is_peak,
+            requires_strict_weeks=season.requires_strict_weeks,
+            booking_types=tuple(booking_types),
+        ))
+    rooms = tuple(conf.rooms.select_related('room_type').order_by('room_number'))
+    return PricingTables(
+        week_start_day=conf.week_start_day,
+        time_of_day_rollover=conf.time_of_day_rollover,
+        max_weeks_till_booking=conf.max_weeks_till_booking,
+        flexible_booking_weeks=conf.flexible_booking_weeks,
+        last_minute_booking_weeks=conf.last_minute_booking_weeks,
+        room_numbers=frozenset(r.room_number for r in rooms),
+        rooms=rooms,
+        seasons=tuple(seasons),
+    )
+
+
+def booking_type_rule(booking_type: config.BookingType) -> BookingTypeRule:
+    return BookingTypeRule(
+        pk=booking_type.pk,
+        booking_type_name=booking_type.booking_type_name,
+        rate=booking_type.rate,
+        is_full_week_only=booking_type.is_full_week_only,
+        sets_weekly_rate_cap=booking_type.sets_weekly_rate_cap,
+        requires_flexible_booking_period=booking_type.requires_flexible_booking_period,
+        requires_last_minute_booking_period=booking_type.requires_last_minute_booking_period,
+        is_flat_rate=booking_type.is_flat_rate,
+        banned_rooms=frozenset(r.room_number for r in booking_type.banned_rooms.all()),
+        minimum_rooms=booking_type.minimum_rooms,
+        priority_rank=booking_type.priority_rank,
+    )
+
+
+# Each process keeps the tables it last loaded along with the generation token they were loaded under. The token lives
+# in the shared cache so saving a config snippet in one worker invalidates the tables in all of them. During a request
+# the token is only checked the first time the tables are asked for, see the request_started receiver in signals.
+_loaded_tables = (None, None)
+_request = threading.local()
+
+
+def pricing_tables() -> PricingTables:
+    """The current PricingTables, reloaded only when the config has changed"""
+    global _loaded_tables
+    loaded_token, tables = _loaded_tables
+    if tables is not None and getattr(_request, 'checked', False):
+        return tables
+    token = cache.get(PRICING_GENERATION_KEY)
+    if token is None:
+        cache.add(PRICING_GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+        token = cache.get(PRICING_GENERATION_KEY)
+    if tables is None or loaded_token != token:
+        tables = load_pricing_tables()
+        _loaded_tables = (token, tables)
+    _request.checked = getattr(_request, 'active', False)
+    return tables
+
+
+def start_request():
+    """Check the generation token once, on the first pricing_tables() call of the request"""
+    _request.active = True
+    _request.checked = False
+
+
+def finish_request():
+    _request.active = False
+    _request.checked = False
+
+
+# The window last computed and the tables it was computed from, reused until the next rollover
+_window = (None, None)
+
+
+def booking_window(tables: PricingTables = None, now: datetime = None) -> BookingWindow:
+    """The current BookingWindow, computed once per rollover. Pass now to compute the window at another moment"""
+    global _window
+    if tables is None:
+        tables = pricing_tables()
+    if now is not None:
+        return BookingWindow.at(tables, now)
+    now = timezone.now()
+    window_tables, window = _window
+    if window is None or window_tables is not tables or window.valid_until <= now:
+        window = BookingWindow.at(tables, now)
+        _window = (tables, window)
+    return window
+
+
+def invalidate_pricing_tables():
+    global _loaded_tables
+    _loaded_tables = (None, None)
+    cache.set(PRICING_GENERATION_KEY, uuid.uuid4().hex, timeout=None)
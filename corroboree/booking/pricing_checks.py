@@ -0,0 +1,242 @@
+import time
+from datetime import date, time as time_of_day, timedelta
+from decimal import Decimal
+
+from corroboree.booking.models import BookingCartPeriod, dates_to_weeks, price_booking_cart, seasons_to_season_on_day
+from corroboree.booking.pricing import BookingCartLine, BookingTypeRule, BookingWindow, PricingTables, SeasonRule, \
+    last_weekday_date, rollover_instant
+from corroboree.config import models as config
+
+
+# Pricing checks
+#
+# check-pricing prices every stay of up to a few weeks arriving on every day of a multi-year horizon, against fixture
+# configs built in memory and optionally the site's own, and checks each priced cart against the invariants below. It
+# times each stay as it goes so changes to the cart code can be checked for both correctness and speed. Nothing is read
+# from or written to the database except the site's config when it is asked for.
+
+def fixture_booking_type(pk: int, name: str, rate: str, priority_rank: int, **fields) -> BookingTypeRule:
+    """A BookingTypeRule with everything not given turned off"""
+    defaults = {
+        'is_full_week_only': False,
+        'sets_weekly_rate_cap': False,
+        'requires_flexible_booking_period': False,
+        'requires_last_minute_booking_period': False,
+        'is_flat_rate': False,
+        'banned_rooms': frozenset(),
+        'minimum_rooms': 1,
+    }
+    return BookingTypeRule(pk=pk, booking_type_name=name, rate=Decimal(rate), priority_rank=priority_rank,
+                           **dict(defaults, **fields))
+
+
+def fixture_season(pk: int, name: str, start_month: int, end_month: int, booking_types: [BookingTypeRule],
+                   season_is_peak=False, requires_strict_weeks=False) -> SeasonRule:
+    return SeasonRule(
+        pk=pk,
+        season_name=name,
+        max_monthly_room_weeks=None,
+        start_month=start_month,
+        end_month=end_month,
+        season_is_peak=season_is_peak,
+        requires_strict_weeks=requires_strict_weeks,
+        booking_types=tuple(sorted(booking_types, key=lambda t: (t.priority_rank, t.pk))),
+    )
+
+
+def fixture_tables(seasons: [SeasonRule], week_start_day=5, rooms=6) -> PricingTables:
+    """PricingTables for a lodge of unsaved rooms numbered from 1"""
+    room_list = tuple(config.Room(room_number=number) for number in range(1, rooms + 1))
+    return PricingTables(
+        week_start_day=week_start_day,
+        time_of_day_rollover=time_of_day(9),
+        max_weeks_till_booking=26,
+        flexible_booking_weeks=2,
+        last_minute_booking_weeks=1,
+        room_numbers=frozenset(r.room_number for r in room_list),
+        rooms=room_list,
+        seasons=tuple(seasons),
+    )
+
+
+def off_peak_types(first_pk: int) -> [BookingTypeRule]:
+    return [
+        fixture_booking_type(first_pk, 'Whole lodge', '500', 1, is_flat_rate=True, minimum_rooms=6),
+        fixture_booking_type(first_pk + 1, 'Nightly', '40', 2),
+        fixture_booking_type(first_pk + 2, 'Weekly cap', '200', 3, sets_weekly_rate_cap=True),
+    ]
+
+
+def peak_types(first_pk: int) -> [BookingTypeRule]:
+    return [
+        fixture_booking_type(first_pk, 'Peak week', '700', 1, is_full_week_only=True, sets_weekly_rate_cap=True,
+                             banned_rooms=frozenset({6})),
+        fixture_booking_type(first_pk + 1, 'Peak last minute', '90', 2, requires_last_minute_booking_period=True),
+        fixture_booking_type(first_pk + 2, 'Peak flexible', '110', 3, requires_flexible_booking_period=True,
+                             banned_rooms=frozenset({6})),
+    ]
+
+
+def fixture_configs() -> {str: PricingTables}:
+    """A lodge with one season all year, one with a strict weeks peak season in winter, and one with a peak season
+    wrapping over new year and weeks starting on monday"""
+    return {
+        'one season': fixture_tables([fixture_season(1, 'All year', 1, 12, off_peak_types(1))]),
+        'winter peak': fixture_tables([
+            fixture_season(1, 'All year', 1, 12, off_peak_types(1)),
+            fixture_season(2, 'Winter', 6, 9, peak_types(4), season_is_peak=True, requires_strict_weeks=True),
+        ]),
+        'wrapped peak': fixture_tables([
+            fixture_season(1, 'All year', 1, 12, off_peak_types(1)),
+            fixture_season(2, 'Summer', 11, 2, peak_types(4), season_is_peak=True, requires_strict_weeks=True),
+        ], week_start_day=0),
+    }
+
+
+def room_selections(tables: PricingTables) -> [list]:
+    """One room, two rooms, and every room, which includes any room a booking type bans"""
+    rooms = list(tables.rooms)
+    return [rooms[:1], rooms[:2], rooms]
+
+
+def window_at(tables: PricingTables, day: date) -> BookingWindow:
+    """The booking window an hour after the rollover on day"""
+    return BookingWindow.at(tables, rollover_instant(day, tables.time_of_day_rollover) + timedelta(hours=1))
+
+
+# Invariants
+#
+# Each check returns a list of the ways something is wrong, empty when it is right.
+
+def check_day(day: date, tables: PricingTables) -> [str]:
+    """last_weekday_date for every weekday, and seasons_to_season_on_day, on one day"""
+    problems = []
+    for weekday in range(7):
+        week_start = last_weekday_date(day, weekday)
+        if week_start.weekday() != weekday or not 0 <= (day - week_start).days <= 6:
+            problems.append(f'last_weekday_date({day}, {weekday}) is {week_start}')
+    try:
+        season = seasons_to_season_on_day(tables.seasons, day)
+    except (ValueError, IndexError) as e:
+        return problems + [f'no single season on {day}: {e!r}']
+    in_season = [s for s in tables.seasons if s.date_is_in_season(day)]
+    if season not in in_season or (len(in_season) > 1 and not season.season_is_peak):
+        problems.append(f'season on {day} is {season} of {in_season}')
+    return problems
+
+
+def check_weeks(arrival_date: date, departure_date: date, week_start_day: int) -> [str]:
+    leading_days, weeks, trailing_days = dates_to_weeks(arrival_date, departure_date, week_start_day)
+    total_days = (departure_date - arrival_date).days
+    if leading_days + 7 * weeks + trailing_days != total_days or weeks < 0 or not (
+            0 <= leading_days <= 6 and 0 <= trailing_days <= 6):
+        return [f'dates_to_weeks({arrival_date}, {departure_date}) is {leading_days, weeks, trailing_days}']
+    return []
+
+
+def check_period(period: BookingCartPeriod, end_date: date, tables: PricingTables, window: BookingWindow) -> [str]:
+    """The shape of one period of a stay ending on end_date, and its booking type and cost"""
+    problems = []
+    days = (period.end_date - period.start_date).days
+    if not 0 < days <= 7:
+        problems.append(f'{days} days long')
+    if period.is_full_week != (days == 7):
+        problems.append(f'is_full_week is {period.is_full_week} for {days} days')
+    if period.is_last_minute_period != (period.end_date <= window.last_minute_period_end):
+        problems.append(f'is_last_minute_period is {period.is_last_minute_period}')
+    if period.is_flexible_period != (period.end_date <= window.flexible_period_end):
+        problems.append(f'is_flexible_period is {period.is_flexible_period}')
+    if period.start_season != seasons_to_season_on_day(tables.seasons, period.start_date):
+        problems.append(f'starts in {period.start_season}')
+    if period.end_date.month != period.start_date.month and \
+            period.end_season != seasons_to_season_on_day(tables.seasons, period.end_date):
+        problems.append(f'ends in {period.end_season}')
+    relaxed = period.start_date + timedelta(weeks=1) <= window.last_minute_period_end
+    if period.end_date != end_date:
+        if period.start_season.requires_strict_weeks and not relaxed:
+            if period.end_date.weekday() != tables.week_start_day:
+                problems.append('strict week ends off the week start day')
+        elif days != 7:
+            problems.append(f'only the last period can be short, not {days} days')
+    booking_type = period.booking_type
+    if booking_type is None:
+        return problems
+    if booking_type not in (period.valid_booking_types[0] or ()):
+        problems.append(f'{booking_type} is not valid for the period')
+    if booking_type.banned_rooms & period.room_numbers or booking_type.minimum_rooms > len(period.room_numbers):
+        problems.append(f'{booking_type} does not allow rooms {sorted(period.room_numbers)}')
+    if booking_type.is_full_week_only and not period.is_full_week or \
+            booking_type.requires_last_minute_booking_period and not period.is_last_minute_period or \
+            booking_type.requires_flexible_booking_period and not period.is_flexible_period:
+        problems.append(f'{booking_type} used outside its period')
+    if period.cost < 0:
+        problems.append(f'costs {period.cost}')
+    capping_type = period.start_season.weekly_rate_cap()
+    if capping_type is not None and not booking_type.is_full_week_only and \
+            period.cost > capping_type.rate * len(period.room_numbers):
+        problems.append(f'costs {period.cost}, over the weekly cap of {capping_type.rate} a room')
+    line = BookingCartLine.from_period(period)
+    if BookingCartLine.from_json(line.to_json()) != line or line.cost != period.cost:
+        problems.append(f'quote line {line.to_json()} does not round trip')
+    return problems
+
+
+def check_stay(periods: [BookingCartPeriod], arrival_date: date, departure_date: date, tables: PricingTables,
+               window: BookingWindow) -> [str]:
+    """The periods of a priced stay cover it end to end without gaps, and each period holds"""
+    problems = []
+    if not periods or periods[0].start_date != arrival_date or periods[-1].end_date != departure_date:
+        problems.append('periods do not cover the stay')
+    for previous, period in zip(periods, periods[1:]):
+        if period.start_date != previous.end_date:
+            problems.append(f'gap between {previous.end_date} and {period.start_date}')
+    for period in periods:
+        problems.extend(f'{period.start_date} - {period.end_date}: {problem}'
+                        for problem in check_period(period, departure_date, tables, window))
+    return problems
+
+
+def percentile(timings: [float], percent: int) -> float:
+    """Of sorted timings, nearest rank"""
+    return timings[min(len(timings) - 1, len(timings) * percent // 100)] if timings else 0.0
+
+
+def check_pricing(tables: PricingTables, start: date, years: int, max_nights: int) -> dict:
+    """Price every stay of 1 to max_nights nights arriving on each day of years from start, in each room selection,
+    in the booking window of start.
+
+    Returns how many stays and periods were priced, how many periods no booking type fits, the problems found and the
+    latency of each stay in seconds, sorted"""
+    window = window_at(tables, start)
+    horizon = [start + timedelta(days=offset) for offset in range(365 * years)]
+    problems = []
+    for day in horizon + [horizon[-1] + timedelta(days=offset) for offset in range(1, max_nights + 1)]:
+        problems.extend(check_day(day, tables))
+    selections = room_selections(tables)
+    timings = []
+    periods_priced = unpriced = 0
+    for arrival_date in horizon:
+        for nights in range(1, max_nights + 1):
+            departure_date = arrival_date + timedelta(days=nights)
+            problems.extend(check_weeks(arrival_date, departure_date, tables.week_start_day))
+            for rooms in selections:
+                stay = f'{arrival_date} - {departure_date} in {len(rooms)} rooms'
+                started = time.perf_counter()
+                try:
+                    periods = price_booking_cart(arrival_date, departure_date, rooms, tables, window=window)
+                except Exception as e:
+                    problems.append(f'{stay}: raised {e!r}')
+                    continue
+                timings.append(time.perf_counter() - started)
+                periods_priced += len(periods)
+                unpriced += sum(1 for period in periods if period.booking_type is None)
+                problems.extend(f'{stay}: {problem}'
+                                for problem in check_stay(periods, arrival_date, departure_date, tables, window))
+    timings.sort()
+    return {
+        'stays': len(timings),
+        'periods': periods_priced,
+        'unpriced': unpriced,
+        'problems': problems,
+        'timings': timings,
+    }
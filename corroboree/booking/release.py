@@ -0,0 +1,99 @@
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.utils import timezone
+
+from corroboree.booking.availability import availability_generation, availability_snapshot, booking_horizon, \
+    snapshot_covers
+from corroboree.booking.models import BookingRecord, ReservationTicket
+from corroboree.booking.pricing import booking_window, pricing_tables
+from corroboree.booking.reservations import reserve_rooms
+from corroboree.config import models as config
+
+QUEUE_RETRY_SECONDS = 2  # how long the room chooser waits before asking again for a queued member's turn
+
+
+# Release window
+#
+# A week is released at time_of_day_rollover on the week start day. For a few minutes either side of that moment
+# almost every request is a member looking at the calendar or the room chooser, so the caches are warmed beforehand,
+# the calendar is served from a shared snapshot and reservations are queued, see settings.BOOKING_RELEASE_*.
+
+def release_window_open(now: datetime = None) -> bool:
+    """Whether a week is being released, i.e. now is within the configured window around a rollover"""
+    window = booking_window(now=now)
+    now = timezone.now() if now is None else now
+    before = timedelta(seconds=settings.BOOKING_RELEASE_WINDOW_BEFORE)
+    after = timedelta(seconds=settings.BOOKING_RELEASE_WINDOW_AFTER)
+    return (window.last_release <= now <= window.last_release + after or
+            window.next_release - before <= now <= window.next_release)
+
+
+def prewarm_release_caches() -> dict:
+    """Load what the first requests of a release would otherwise all load at once.
+
+    Sets up the pricing generation and fills the shared availability generation and a snapshot over the whole booking
+    horizon. Run just before the rollover, see the prewarm-release command."""
+    tables = pricing_tables()
+    availability_generation()
+    first_day, last_day = booking_horizon(tables)
+    return availability_snapshot(first_day, last_day, max_age=timedelta(0))
+
+
+def release_snapshot(first_day: date, last_day: date) -> dict | None:
+    """The release availability snapshot if it can answer for [first_day, last_day), i.e. within the booking horizon"""
+    horizon_first_day, horizon_last_day = booking_horizon(pricing_tables())
+    horizon = {'first_day': horizon_first_day, 'last_day': horizon_last_day}
+    if not snapshot_covers(horizon, first_day, last_day):
+        return None
+    max_age = timedelta(seconds=settings.BOOKING_RELEASE_SNAPSHOT_SECONDS)
+    return availability_snapshot(horizon_first_day, horizon_last_day, max_age=max_age)
+
+
+# Reservation queue
+#
+# Each member waiting to reserve holds one ReservationTicket. Tickets are served in the order they were taken and
+# only the first BOOKING_RELEASE_QUEUE_CONCURRENCY are allowed to reserve at once, so the workers take turns at the
+# room locks rather than all blocking on them together. A member whose turn hasn't come is answered straight away with
+# their place in the queue and the room chooser asks again every QUEUE_RETRY_SECONDS, so waiting members never hold a
+# worker. A ticket is dropped once its member hasn't asked for BOOKING_RELEASE_QUEUE_TIMEOUT, e.g. they closed the
+# page or the worker reserving for them was killed.
+
+def take_ticket(member: config.Member) -> ReservationTicket:
+    """The member's ticket, taken now or kept from an earlier attempt"""
+    stale = timezone.now() - timedelta(seconds=settings.BOOKING_RELEASE_QUEUE_TIMEOUT)
+    ReservationTicket.objects.filter(last_seen__lt=stale).delete()
+    try:
+        ticket, created = ReservationTicket.objects.get_or_create(member=member)
+    except IntegrityError:  # the same member submitted twice at once, share their place
+        ticket, created = ReservationTicket.objects.get(member=member), False
+    if not created:
+        ReservationTicket.objects.filter(pk=ticket.pk).update(last_seen=timezone.now())
+    return ticket
+
+
+def tickets_ahead(ticket: ReservationTicket) -> int:
+    return ReservationTicket.objects.filter(pk__lt=ticket.pk).count()
+
+
+def reserve_rooms_in_turn(member: config.Member, arrival_date: date, departure_date: date,
+                          rooms: [config.Room]) -> BookingRecord:
+    """reserve_rooms, if it is the member's turn in the release queue.
+
+    Otherwise raises ValidationError with code 'queued' and keeps the member's ticket, so asking again keeps their
+    place"""
+    ticket = take_ticket(member)
+    waiting = tickets_ahead(ticket) - settings.BOOKING_RELEASE_QUEUE_CONCURRENCY
+    if waiting >= 0:
+        raise ValidationError(
+            'Lots of members are booking right now and you are number %(position)s in the queue, '
+            'your booking will be tried again in a moment',
+            code='queued',
+            params={'position': waiting + 1},
+        )
+    try:
+        return reserve_rooms(member, arrival_date, departure_date, rooms)
+    finally:
+        ReservationTicket.objects.filter(pk=ticket.pk).delete()
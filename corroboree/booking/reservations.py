@@ -0,0 +1,50 @@
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from corroboree.booking.models import BookingRecord, booked_rooms, check_season_rules
+from corroboree.config import models as config
+
+
+def reserve_rooms(member: config.Member, arrival_date: date, departure_date: date,
+                  rooms: [config.Room]) -> BookingRecord:
+    """Create an in progress booking holding rooms for a stay, safe against concurrent reservations.
+
+    Availability is checked when the room form validates, but another member can take the same rooms before the
+    booking is written. Here the member and the chosen rooms are locked with SELECT ... FOR UPDATE, availability and
+    season rules are checked again, and the booking is written before the locks are released. Locks are always taken
+    in the same order (member, then rooms by number) so concurrent reservations queue rather than deadlock, and
+    reservations for different rooms don't block each other.
+
+    Raises ValidationError if the rooms have gone or the season rules are no longer met."""
+    room_numbers = sorted(r.room_number for r in rooms)
+    with transaction.atomic():
+        config.Member.objects.select_for_update().get(pk=member.pk)
+        locked_rooms = list(
+            config.Room.objects.select_for_update().filter(room_number__in=room_numbers).order_by('room_number')
+        )
+        taken = set(booked_rooms(arrival_date, departure_date)) & set(room_numbers)
+        if taken:
+            raise ValidationError(
+                'Sorry, room %(rooms)s was booked by someone else while you were choosing',
+                params={'rooms': ', '.join(str(r) for r in sorted(taken))},
+                code='rooms_taken',
+            )
+        check_season_rules(member=member, arrival_date=arrival_date, departure_date=departure_date,
+                           rooms=locked_rooms)
+        booking_record = BookingRecord(
+            member=member,
+            member_name_at_creation=member.full_name(),
+            arrival_date=arrival_date,
+            departure_date=departure_date,
+            member_in_attendance=None,
+            member_in_attendance_name_at_creation='',
+            cost=None,
+            payment_status=BookingRecord.BookingRecordPaymentStatus.NOT_ISSUED,
+            status=BookingRecord.BookingRecordStatus.IN_PROGRESS
+        )
+        booking_record.save()
+        booking_record.rooms.set(locked_rooms)
+        booking_record.calculate_booking_cart()
+    return booking_record
@@ -0,0 +1,193 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import QuerySet, Sum
+
+from corroboree.booking.models import BookingRecord, RoomDayRollup, SeasonMonthRollup, price_booking_cart, \
+    seasons_to_season_on_day
+from corroboree.booking.pricing import PricingTables, SeasonRule, booking_window, last_weekday_date, pricing_tables
+
+BATCH_SIZE = 2000
+CENT = Decimal('0.01')
+
+
+# Reporting rollups
+#
+# The occupancy and revenue report reads two tables rather than the bookings. RoomDayRollup has a row for each room
+# on each night sold to a finalised booking and SeasonMonthRollup sums them by month, season and booking type, so a
+# question spanning years reads a few hundred rows. Both are thrown away and rebuilt each night by
+# rebuild-booking-rollups. The booking type of each period of a booking comes from its quote, or for bookings made
+# before quotes were kept, from pricing it against the current config as it stood when it was last updated. What the
+# member was charged is then split between the periods in proportion to their prices and evenly over each period's
+# room nights.
+
+def finalised_bookings() -> QuerySet[BookingRecord]:
+    return BookingRecord.objects.filter(status=BookingRecord.BookingRecordStatus.FINALISED).only(
+        'arrival_date', 'departure_date', 'cost', 'last_updated', 'booking_cart'
+    ).prefetch_related('rooms')
+
+
+def price_periods(booking: BookingRecord, rooms, tables: PricingTables) -> [(date, date, int | None, Decimal)]:
+    """The (start, end, booking type pk, share of the cost) of each period of a booking, from its quote if it has
+    one"""
+    if booking.booking_cart:
+        priced = [(line.start_date, line.end_date, line.booking_type, line.cost)
+                  for line in booking.booking_cart_lines()]
+    else:
+        periods = price_booking_cart(booking.arrival_date, booking.departure_date, rooms, tables,
+                                     window=booking_window(tables, now=booking.last_updated))
+        priced = [(period.start_date, period.end_date, None, Decimal(0)) if period.booking_type is None else
+                  (period.start_date, period.end_date, period.booking_type.pk, Decimal(period.cost))
+                  for period in periods]
+    total = sum(cost for _, _, _, cost in priced)
+    charged = total if booking.cost is None else booking.cost
+    nights = (booking.departure_date - booking.arrival_date).days
+    return [(start, end, booking_type, charged * cost / total if total else charged * (end - start).days / nights)
+            for start, end, booking_type, cost in priced]
+
+
+def season_on(day: date, tables: PricingTables, seasons: {(int, int): SeasonRule}) -> int | None:
+    """The pk of the season a night falls in, seasons are whole months so each month is only looked up once"""
+    month = (day.year, day.month)
+    if month not in seasons:
+        try:
+            seasons[month] = seasons_to_season_on_day(tables.seasons, day).pk
+        except ValueError:  # no season covers the month
+            seasons[month] = None
+    return seasons[month]
+
+
+def room_day_totals(tables: PricingTables) -> {(date, int, int, int): [int, Decimal]}:
+    """Room nights and revenue keyed by (night, room, season pk, booking type pk) over every finalised booking"""
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    seasons = {}
+    # a quote keeps the pk of a booking type that may since have been deleted
+    booking_types = {booking_type.pk for season in tables.seasons for booking_type in season.booking_types}
+    for booking in finalised_bookings().iterator(chunk_size=BATCH_SIZE):
+        rooms = list(booking.rooms.all())
+        if not rooms or booking.departure_date <= booking.arrival_date:
+            continue
+        for start, end, booking_type, revenue in price_periods(booking, rooms, tables):
+            if booking_type not in booking_types:
+                booking_type = None
+            per_room_night = revenue / ((end - start).days * len(rooms))
+            for offset in range((end - start).days):
+                night = start + timedelta(days=offset)
+                season = season_on(night, tables, seasons)
+                for room in rooms:
+                    total = totals[night, room.pk, season, booking_type]
+                    total[0] += 1
+                    total[1] += per_room_night
+    return totals
+
+
+def rebuild_rollups() -> (int, int):
+    """Throw away and recreate both rollup tables from the booking records. Returns how many rows each has"""
+    totals = room_day_totals(pricing_tables())
+    months = defaultdict(lambda: [0, Decimal(0)])
+    for (night, room, season, booking_type), (room_nights, revenue) in totals.items():
+        month = months[night.replace(day=1), season, booking_type]
+        month[0] += room_nights
+        month[1] += revenue
+    with transaction.atomic():
+        RoomDayRollup.objects.all().delete()
+        SeasonMonthRollup.objects.all().delete()
+        RoomDayRollup.objects.bulk_create(
+            (RoomDayRollup(date=night, room_id=room, season_id=season, booking_type_id=booking_type,
+                           room_nights=room_nights, revenue=revenue.quantize(CENT))
+             for (night, room, season, booking_type), (room_nights, revenue) in totals.items()),
+            batch_size=BATCH_SIZE,
+        )
+        SeasonMonthRollup.objects.bulk_create(
+            (SeasonMonthRollup(month=month, season_id=season, booking_type_id=booking_type, room_nights=room_nights,
+                               revenue=revenue.quantize(CENT))
+             for (month, season, booking_type), (room_nights, revenue) in months.items()),
+            batch_size=BATCH_SIZE,
+        )
+    return len(totals), len(months)
+
+
+# Reading the rollups
+#
+# Occupancy is room nights sold over room nights available, the number of rooms times the nights in the period.
+
+def occupancy(room_nights: int, nights: int, rooms: int) -> float | None:
+    return 100 * room_nights / (nights * rooms) if nights and rooms else None
+
+
+def month_starts(start_year: int, end_year: int) -> [date]:
+    return [date(year, month, 1) for year in range(start_year, end_year + 1) for month in range(1, 13)]
+
+
+def days_in_month(month: date) -> int:
+    return ((month + timedelta(days=32)).replace(day=1) - month).days
+
+
+def season_report(start_year: int, end_year: int, tables: PricingTables) -> [dict]:
+    """Room nights, occupancy and revenue for each season of each year"""
+    sold = {(row['month__year'], row['season']): row for row in SeasonMonthRollup.objects.filter(
+        month__year__gte=start_year, month__year__lte=end_year,
+    ).values('month__year', 'season').annotate(room_nights=Sum('room_nights'), revenue=Sum('revenue'))}
+    names = {season.pk: season.season_name for season in tables.seasons}
+    nights = defaultdict(int)
+    seasons = {}
+    for month in month_starts(start_year, end_year):
+        nights[month.year, season_on(month, tables, seasons)] += days_in_month(month)
+    report = []
+    for year, season in sorted(nights.keys() | sold.keys(), key=lambda key: (key[0], names.get(key[1], ''))):
+        row = sold.get((year, season), {'room_nights': 0, 'revenue': Decimal(0)})
+        report.append({
+            'year': year,
+            'season': names.get(season, 'No season'),
+            'room_nights': row['room_nights'],
+            'occupancy': occupancy(row['room_nights'], nights[year, season], len(tables.rooms)),
+            'revenue': row['revenue'],
+        })
+    return report
+
+
+def booking_type_report(start_year: int, end_year: int) -> [dict]:
+    """Room nights and revenue for each booking type of each year"""
+    return list(SeasonMonthRollup.objects.filter(
+        month__year__gte=start_year, month__year__lte=end_year,
+    ).values('month__year', 'booking_type__booking_type_name', 'booking_type__season_active__season_name').annotate(
+        room_nights=Sum('room_nights'), revenue=Sum('revenue'),
+    ).order_by('month__year', '-revenue'))
+
+
+def room_report(start: date, end: date, tables: PricingTables) -> [dict]:
+    """Room nights, occupancy and revenue for each room over the nights from start up to end"""
+    sold = {row['room']: row for row in RoomDayRollup.objects.filter(date__gte=start, date__lt=end).values(
+        'room'
+    ).annotate(room_nights=Sum('room_nights'), revenue=Sum('revenue'))}
+    report = []
+    for room in tables.rooms:
+        row = sold.get(room.pk, {'room_nights': 0, 'revenue': Decimal(0)})
+        report.append({
+            'room': room,
+            'room_nights': row['room_nights'],
+            'occupancy': occupancy(row['room_nights'], (end - start).days, 1),
+            'revenue': row['revenue'],
+        })
+    return report
+
+
+def week_report(start: date, end: date, tables: PricingTables) -> [dict]:
+    """Room nights, occupancy and revenue for each week, starting on the config's week start day, from start up to
+    end"""
+    weeks = {}
+    week = last_weekday_date(start, tables.week_start_day)
+    while week < end:
+        weeks[week] = {'week': week, 'room_nights': 0, 'revenue': Decimal(0)}
+        week += timedelta(weeks=1)
+    for row in RoomDayRollup.objects.filter(date__gte=start, date__lt=end).values('date').annotate(
+            room_nights=Sum('room_nights'), revenue=Sum('revenue')):
+        totals = weeks[last_weekday_date(row['date'], tables.week_start_day)]
+        totals['room_nights'] += row['room_nights']
+        totals['revenue'] += row['revenue']
+    for totals in weeks.values():
+        nights = (min(totals['week'] + timedelta(weeks=1), end) - max(totals['week'], start)).days
+        totals['occupancy'] = occupancy(totals['room_nights'], nights, len(tables.rooms))
+    return list(weeks.values())
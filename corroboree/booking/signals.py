@@ -1,7 +1,13 @@
-from django.db.models.signals import post_save
+from django.core.signals import request_finished, request_started
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 
-from .models import BookingRecord
+from corroboree.config import models as config
+from .availability import bump_availability_generation
+from .models import BookingRecord, RoomNight
+from .occupancy import sync_room_nights
+from .pricing import finish_request, invalidate_pricing_tables, start_request
 
 @receiver(post_save, sender=BookingRecord)
 def send_admin_email(sender, instance: BookingRecord, **kwargs):
@@ -13,4 +19,62 @@ def send_admin_email(sender, instance: BookingRecord, **kwargs):
                             ),
                             email_text='An Administrator created or updated the following booking. '
                                        'Please contact the booking administrator with any concerns.')
-        BookingRecord.objects.filter(pk=instance.pk).update(send_admin_email=False)
\ No newline at end of file
+        BookingRecord.objects.filter(pk=instance.pk).update(send_admin_email=False)
+
+
+@receiver(post_save, sender=BookingRecord)
+def update_room_nights(sender, instance: BookingRecord, **kwargs):
+    """Keep the denormalised RoomNight rows in step with the booking's dates and status"""
+    sync_room_nights(instance)
+
+
+@receiver(m2m_changed, sender=BookingRecord.rooms.through)
+def update_room_nights_for_rooms(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep the denormalised RoomNight rows in step with the booking's rooms"""
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        sync_room_nights(instance)
+    elif action == 'post_clear':  # instance is a room which no longer belongs to any booking
+        RoomNight.objects.filter(room=instance).delete()
+    else:  # instance is a room and pk_set holds the bookings it was added to or removed from
+        for booking in BookingRecord.objects.filter(pk__in=pk_set):
+            sync_room_nights(booking)
+
+
+@receiver(post_save, sender=BookingRecord)
+@receiver(post_delete, sender=BookingRecord)
+@receiver(m2m_changed, sender=BookingRecord.rooms.through)
+def invalidate_availability(sender, **kwargs):
+    """Any change to a booking's dates, rooms or status can change which rooms are free"""
+    action = kwargs.get('action')
+    if action is None or action.startswith('post_'):
+        transaction.on_commit(bump_availability_generation)
+
+
+@receiver(post_save, sender=config.Config)
+@receiver(post_save, sender=config.Season)
+@receiver(post_save, sender=config.BookingType)
+@receiver(post_save, sender=config.Room)
+@receiver(post_save, sender=config.RoomType)
+@receiver(post_delete, sender=config.Season)
+@receiver(post_delete, sender=config.BookingType)
+@receiver(post_delete, sender=config.Room)
+@receiver(post_delete, sender=config.RoomType)
+@receiver(m2m_changed, sender=config.BookingType.banned_rooms.through)
+def invalidate_pricing(sender, **kwargs):
+    """Pricing tables are a snapshot of the config so must be reloaded when it changes"""
+    action = kwargs.get('action')
+    if action is None or action.startswith('post_'):
+        transaction.on_commit(invalidate_pricing_tables)
+
+
+@receiver(request_started)
+def start_config_request(sender, **kwargs):
+    """Within a request the config is only checked for changes once"""
+    start_request()
+
+
+@receiver(request_finished)
+def finish_config_request(sender, **kwargs):
+    finish_request()
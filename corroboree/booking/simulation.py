@@ -0,0 +1,124 @@
+import dataclasses
+import time
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.db.models import QuerySet
+
+from corroboree.booking.models import BookingRecord, price_booking_cart
+from corroboree.booking.pricing import BookingWindow, PricingTables, booking_window, pricing_tables
+
+BATCH_SIZE = 2000
+# The BookingType fields a proposal can change
+SIMULATED_FIELDS = ('rate', 'priority_rank', 'minimum_rooms', 'banned_rooms')
+
+
+# Pricing what-ifs
+#
+# Shows what bookings would have cost had the booking types been different. Every booking is priced twice, under the
+# current config and under a copy of it with the proposed booking type changes, and the two are compared season by
+# season. The bookings and their rooms are read in two queries and pricing needs none, see PricingTables. Each booking
+# is priced in the booking window it was last updated in, so last minute and flexible booking types apply as they did
+# then, and bookings of the same dates and rooms in the same window are only priced once.
+
+def proposed_tables(tables: PricingTables, changes: {int: dict}) -> PricingTables:
+    """A copy of tables with some booking types changed, changes being {booking type pk: {field: value}}"""
+    seasons = []
+    for season in tables.seasons:
+        booking_types = sorted(
+            (dataclasses.replace(booking_type, **changes.get(booking_type.pk, {}))
+             for booking_type in season.booking_types),
+            key=lambda t: (t.priority_rank, t.pk),
+        )
+        seasons.append(dataclasses.replace(season, booking_types=tuple(booking_types)))
+    return dataclasses.replace(tables, seasons=tuple(seasons))
+
+
+def simulated_bookings(arrival_from: date = None, arrival_to: date = None) -> QuerySet[BookingRecord]:
+    """The bookings a what-if reprices, those holding rooms whether past or future"""
+    bookings = BookingRecord.live_objects.all()
+    if arrival_from is not None:
+        bookings = bookings.filter(arrival_date__gte=arrival_from)
+    if arrival_to is not None:
+        bookings = bookings.filter(arrival_date__lte=arrival_to)
+    return bookings
+
+
+def booking_stays(bookings: QuerySet[BookingRecord],
+                  tables: PricingTables) -> {(date, date, BookingWindow, frozenset): int}:
+    """How many bookings there are of each (arrival, departure, booking window when last updated, room numbers)"""
+    rooms = defaultdict(set)
+    for booking_id, room in BookingRecord.rooms.through.objects.filter(bookingrecord__in=bookings).values_list(
+            'bookingrecord_id', 'room_id').iterator(chunk_size=BATCH_SIZE):
+        rooms[booking_id].add(room)
+    stays = defaultdict(int)
+    for pk, arrival_date, departure_date, last_updated in bookings.values_list(
+            'pk', 'arrival_date', 'departure_date', 'last_updated').iterator(chunk_size=BATCH_SIZE):
+        if rooms[pk] and arrival_date < departure_date:
+            window = booking_window(tables, now=last_updated)
+            stays[arrival_date, departure_date, window, frozenset(rooms[pk])] += 1
+    return stays
+
+
+def season_costs(stay: (date, date, BookingWindow, frozenset), tables: PricingTables) -> {int: Decimal}:
+    """The cost of a stay in each season it falls in, None if a period of it can't be priced"""
+    arrival_date, departure_date, window, room_numbers = stay
+    rooms = [room for room in tables.rooms if room.room_number in room_numbers]
+    costs = defaultdict(Decimal)
+    for period in price_booking_cart(arrival_date, departure_date, rooms, tables, window=window):
+        if period.cost is None:
+            return None
+        costs[period.start_season.pk] += Decimal(period.cost)
+    return costs
+
+
+def simulate_pricing(changes: {int: dict}, bookings: QuerySet[BookingRecord] = None) -> dict:
+    """Price bookings under the current booking types and under the changed ones.
+
+    Returns a row per season of the current and proposed revenue and the difference, with totals, how many bookings
+    were repriced, changed price and couldn't be priced under the proposal, and how long reading and pricing them
+    took"""
+    if bookings is None:
+        bookings = simulated_bookings()
+    current = pricing_tables()
+    proposed = proposed_tables(current, changes)
+    started = time.perf_counter()
+    stays = booking_stays(bookings, current)
+    revenue = defaultdict(lambda: [Decimal(0), Decimal(0)])
+    repriced = changed = unpriced = 0
+    for stay, count in stays.items():
+        current_costs = season_costs(stay, current)
+        if current_costs is None:  # can't be compared, e.g. booked under since removed booking types
+            continue
+        proposed_costs = season_costs(stay, proposed)
+        repriced += count
+        if proposed_costs is None:
+            unpriced += count
+            proposed_costs = {}
+        if proposed_costs != current_costs:
+            changed += count
+        for season, cost in current_costs.items():
+            revenue[season][0] += cost * count
+        for season, cost in proposed_costs.items():
+            revenue[season][1] += cost * count
+    names = {season.pk: season.season_name for season in current.seasons}
+    seasons = [{
+        'season': names[season],
+        'current': current_revenue,
+        'proposed': proposed_revenue,
+        'difference': proposed_revenue - current_revenue,
+    } for season, (current_revenue, proposed_revenue) in sorted(revenue.items(), key=lambda item: names[item[0]])]
+    current_total = sum(row['current'] for row in seasons)
+    proposed_total = sum(row['proposed'] for row in seasons)
+    return {
+        'seasons': seasons,
+        'current': current_total,
+        'proposed': proposed_total,
+        'difference': proposed_total - current_total,
+        'bookings': sum(stays.values()),
+        'repriced': repriced,
+        'changed': changed,
+        'unpriced': unpriced,
+        'seconds': time.perf_counter() - started,
+    }
@@ -1,16 +1,31 @@
+from datetime import date
+from functools import cached_property
+
+from django.urls import path, reverse
+from django.views.generic import TemplateView
+from wagtail import hooks
+from wagtail.admin.menu import MenuItem
+from wagtail.admin.views.generic import PermissionCheckedMixin, WagtailAdminTemplateMixin
+from wagtail.permission_policies import ModelPermissionPolicy
 from wagtail.snippets.models import register_snippet
-from wagtail.snippets.views.snippets import SnippetViewSet
+from wagtail.snippets.views.snippets import IndexView, SnippetViewSet
 from django_filters import FilterSet, ModelMultipleChoiceFilter, CharFilter, DateFilter, ChoiceFilter
 from wagtail.admin.widgets import AdminDateInput
 from wagtail.admin.panels import FieldPanel, FieldRowPanel
+from django.db.models import Count, Prefetch, Q
 from django.forms import CheckboxSelectMultiple
 
+from .exports import csv_response, xlsx_response
+from .forms import OccupancyReportForm, PricingProposalForm
 from .models import BookingRecord
+from .pricing import pricing_tables
+from .rollups import booking_type_report, room_report, season_report, week_report
+from .simulation import simulate_pricing, simulated_bookings
 from corroboree.config import models as config
 
 class BookingRecordFilter(FilterSet):
     rooms = ModelMultipleChoiceFilter(
-        queryset=config.Room.objects.all(),
+        queryset=config.Room.objects.select_related('room_type'),
         widget=CheckboxSelectMultiple,
         label='Rooms',
         method='filter_rooms',
@@ -51,9 +66,125 @@ class BookingRecordFilter(FilterSet):
         ]
 
     def filter_rooms(self, queryset, name, value):
-        for room in value:
-            queryset = queryset.filter(rooms=room)
-        return queryset
+        """Bookings with every one of the rooms, found with one grouped subquery rather than a join per room"""
+        if not value:
+            return queryset
+        with_all_rooms = BookingRecord.rooms.through.objects.filter(room__in=value).values('bookingrecord').annotate(
+            rooms=Count('room')
+        ).filter(rooms=len(value)).values('bookingrecord')
+        return queryset.filter(pk__in=with_all_rooms)
+
+
+# Keyset pagination
+#
+# Ordered by arrival date, the default, the bookings listing is paged by the (arrival_date, id) of the last booking
+# shown rather than by page number. Each page is read from the arrival date index starting at that key, so the
+# hundredth page of years of bookings costs the same as the first, where an OFFSET has to read past every booking
+# before it. Other orderings keep Wagtail's numbered pages.
+
+KEYSET_ORDERINGS = {'arrival_date': False, '-arrival_date': True}  # ordering: whether it is descending
+
+
+def booking_key(booking: BookingRecord, descending: bool) -> str:
+    """A booking's place in the listing, which says which way the listing runs so sorting it the other way, which
+    keeps the rest of the query string, starts again from the first page"""
+    return '{arrival_date}.{id}.{direction}'.format(
+        arrival_date=booking.arrival_date.isoformat(),
+        id=booking.pk,
+        direction='desc' if descending else 'asc',
+    )
+
+
+def parse_booking_key(key: str, descending: bool) -> (date, int):
+    """The arrival date and id in a key from booking_key for a listing running the same way, otherwise None"""
+    arrival_date, _, rest = key.partition('.')
+    pk, _, direction = rest.partition('.')
+    if direction != ('desc' if descending else 'asc'):
+        return None
+    try:
+        return date.fromisoformat(arrival_date), int(pk)
+    except ValueError:
+        return None
+
+
+def beyond_key(queryset, key: (date, int), descending: bool):
+    """The bookings after a key in (arrival_date, id) order, or before it when descending"""
+    arrival_date, pk = key
+    if descending:
+        return queryset.filter(Q(arrival_date__lt=arrival_date) | Q(arrival_date=arrival_date, pk__lt=pk))
+    return queryset.filter(Q(arrival_date__gt=arrival_date) | Q(arrival_date=arrival_date, pk__gt=pk))
+
+
+class KeysetPage:
+    """A page of bookings with the keys of the pages either side, standing in for Django's Page and Paginator"""
+    is_keyset = True
+
+    def __init__(self, queryset, object_list: [BookingRecord], previous_key: str | None, next_key: str | None):
+        self.queryset = queryset
+        self.object_list = object_list
+        self.previous_key = previous_key
+        self.next_key = next_key
+
+    @cached_property
+    def count(self) -> int:
+        return self.queryset.count()
+
+
+def keyset_page(queryset, page_size: int, after: str = None, before: str = None,
+                descending: bool = False) -> KeysetPage:
+    """The page_size bookings after the key after, or before the key before, or else the first page"""
+    after, before = parse_booking_key(after or '', descending), parse_booking_key(before or '', descending)
+    if before is not None:
+        pk_order = 'pk' if descending else '-pk'
+        rows = list(beyond_key(queryset, before, not descending).order_by(
+            'arrival_date' if descending else '-arrival_date', pk_order
+        )[:page_size + 1])
+        bookings = rows[:page_size][::-1]
+        more_before, more_after = len(rows) > page_size, True
+    else:
+        rows = list((queryset if after is None else beyond_key(queryset, after, descending))[:page_size + 1])
+        bookings = rows[:page_size]
+        more_before, more_after = after is not None, len(rows) > page_size
+    return KeysetPage(
+        queryset,
+        bookings,
+        booking_key(bookings[0], descending) if bookings and more_before else None,
+        booking_key(bookings[-1], descending) if bookings and more_after else None,
+    )
+
+
+class BookingRecordIndexView(IndexView):
+    default_ordering = '-arrival_date'
+
+    def get(self, request, *args, **kwargs):
+        """Downloads skip building the listing page and are written a chunk of bookings at a time, see exports.py"""
+        if self.is_export:
+            if request.GET['export'] == self.FORMAT_CSV:
+                return csv_response(self.get_queryset(), self.get_filename())
+            return xlsx_response(self.get_queryset(), self.get_filename())
+        return super().get(request, *args, **kwargs)
+
+    def get_base_queryset(self):
+        """The listing shows each booking's rooms and members, read for the whole page at once"""
+        queryset = super().get_base_queryset()
+        if self.is_export:  # exports.export_bookings prefetches a chunk at a time instead
+            return queryset
+        return queryset.select_related('member', 'member_in_attendance').prefetch_related(
+            Prefetch('rooms', queryset=config.Room.objects.select_related('room_type'))
+        )
+
+    def order_queryset(self, queryset):
+        if self.ordering in KEYSET_ORDERINGS:  # the id breaks ties between bookings arriving the same day
+            return queryset.order_by(self.ordering, '-pk' if KEYSET_ORDERINGS[self.ordering] else 'pk')
+        return super().order_queryset(queryset)
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.ordering not in KEYSET_ORDERINGS:
+            return super().paginate_queryset(queryset, page_size)
+        page = keyset_page(queryset, page_size, after=self.request.GET.get('after'),
+                           before=self.request.GET.get('before'), descending=KEYSET_ORDERINGS[self.ordering])
+        return page, page, page.object_list, True
+
 
 class BookingRecordViewSet(SnippetViewSet):
     model = BookingRecord
@@ -73,7 +204,7 @@ class BookingRecordViewSet(SnippetViewSet):
         'paypal_transaction_id',
         'rooms_list',
     ]
-    list_export = [
+    list_export = [  # turns on the download buttons, the columns are those of exports.export_headings
         'member',
         'member_name_at_creation',
         'last_updated',
@@ -81,19 +212,21 @@ class BookingRecordViewSet(SnippetViewSet):
         'departure_date',
         'member_in_attendance',
         'member_in_attendance_name_at_creation',
-        'other_attendees',
         'status',
         'payment_status',
         'cost',
         'paypal_transaction_id',
         'rooms_list',
+        'other_attendees',
     ]
+    export_filename = 'bookings'
     list_per_page = 50
     copy_view_enabled = False
     inspect_view_enabled = True
     admin_url_namespace = 'bookings_view'
     base_url_path = 'internal/bookings'
     filterset_class = BookingRecordFilter
+    index_view_class = BookingRecordIndexView
 
     panels = [
         FieldRowPanel([
@@ -121,3 +254,81 @@ class BookingRecordViewSet(SnippetViewSet):
 
 
 register_snippet(BookingRecordViewSet)
+
+
+class OccupancyReportView(PermissionCheckedMixin, WagtailAdminTemplateMixin, TemplateView):
+    """Room nights sold, occupancy and revenue over whole years, read from the rollups, see rollups.py"""
+    permission_policy = ModelPermissionPolicy(BookingRecord)
+    permission_required = 'view'
+    page_title = 'Occupancy and revenue'
+    header_icon = 'table'
+    template_name = 'booking/reports/occupancy_report.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        this_year = date.today().year
+        form = OccupancyReportForm(self.request.GET or {'start_year': this_year, 'end_year': this_year})
+        context['form'] = form
+        if form.is_valid():
+            start_year, end_year = form.cleaned_data['start_year'], form.cleaned_data['end_year']
+            start, end = date(start_year, 1, 1), date(end_year + 1, 1, 1)
+            tables = pricing_tables()
+            context['seasons'] = season_report(start_year, end_year, tables)
+            context['booking_types'] = booking_type_report(start_year, end_year)
+            context['rooms'] = room_report(start, end, tables)
+            context['weeks'] = week_report(start, end, tables)
+        return context
+
+
+class PricingSimulationView(PermissionCheckedMixin, WagtailAdminTemplateMixin, TemplateView):
+    """What bookings would cost with the booking types changed, see simulation.py"""
+    permission_policy = ModelPermissionPolicy(BookingRecord)
+    permission_required = 'view'
+    page_title = 'Pricing what-if'
+    header_icon = 'sliders'
+    template_name = 'booking/reports/pricing_simulation.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        form = PricingProposalForm(self.request.GET or None)
+        context['form'] = form
+        if form.is_valid():
+            context['result'] = simulate_pricing(form.changes(), simulated_bookings(
+                form.cleaned_data['arrival_from'], form.cleaned_data['arrival_to']
+            ))
+        return context
+
+
+class BookingReportMenuItem(MenuItem):
+    def is_shown(self, request):
+        return ModelPermissionPolicy(BookingRecord).user_has_permission(request.user, 'view')
+
+
+@hooks.register('register_admin_urls')
+def register_booking_report_urls():
+    return [
+        path('reports/occupancy/', OccupancyReportView.as_view(), name='booking_occupancy_report'),
+        path('reports/pricing-what-if/', PricingSimulationView.as_view(), name='booking_pricing_simulation'),
+    ]
+
+
+@hooks.register('register_reports_menu_item')
+def register_occupancy_report_menu_item():
+    return BookingReportMenuItem(
+        'Occupancy and revenue',
+        reverse('booking_occupancy_report'),
+        name='occupancy-and-revenue',
+        icon_name='table',
+        order=1000,
+    )
+
+
+@hooks.register('register_reports_menu_item')
+def register_pricing_simulation_menu_item():
+    return BookingReportMenuItem(
+        'Pricing what-if',
+        reverse('booking_pricing_simulation'),
+        name='pricing-what-if',
+        icon_name='sliders',
+        order=1010,
+    )
@@ -13,8 +13,7 @@ from wagtail.admin.panels import FieldPanel, FieldRowPanel, InlinePanel
 # Validators
 def validate_only_one_instance(obj):
     model = obj.__class__
-    if (model.objects.count() > 0 and
-            obj.pk != model.objects.get().pk):
+    if model.objects.exclude(pk=obj.pk).exists():
         raise ValidationError("Can only create 1 %s instance" % model.__name__)
 
 
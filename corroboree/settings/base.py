@@ -25,6 +25,13 @@ PAYPAL_CLIENT_SECRET = os.getenv('PAYPAL_CLIENT_SECRET')
 PAYPAL_MERCHANT_EMAIL = os.getenv('PAYPAL_MERCHANT_EMAIL')
 SECURE_CROSS_ORIGIN_OPENER_POLICY = 'same-origin-allow-popups'  # fixes paypal popup
 PAYPAL_SANDBOX = True
+PAYPAL_WEBHOOK_ID = os.getenv('PAYPAL_WEBHOOK_ID')  # the webhook's id in the PayPal developer dashboard
+# Class views take payments through, created on first use. corroboree.booking.paypal.FakeGateway never contacts PayPal
+# and is for development and load testing.
+PAYPAL_GATEWAY = 'corroboree.booking.paypal.PayPalGateway'
+PAYPAL_CONNECT_TIMEOUT = 5  # seconds to connect to PayPal before giving up
+PAYPAL_READ_TIMEOUT = 30  # seconds to wait for PayPal's response
+PAYPAL_FAKE_LATENCY = 0  # seconds each FakeGateway call takes
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
@@ -108,6 +115,39 @@ WSGI_APPLICATION = "corroboree.wsgi.application"
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Shared between gunicorn workers so cached room availability is invalidated for all of them at once.
+# Create the table with `python manage.py createcachetable`
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "corroboree_cache",
+    }
+}
+
+
+# Booking holds
+# How long an in progress or submitted booking holds its rooms after it was last saved, in seconds. Stored on each
+# booking as expires_at when it is saved, so changing these only affects bookings saved afterwards.
+BOOKING_IN_PROGRESS_HOLD_LIMIT = 30 * 60
+BOOKING_SUBMITTED_HOLD_LIMIT = 24 * 60 * 60
+
+
+# Booking release
+# A new week opens for booking at Config.time_of_day_rollover on the week start day and most members try to book at
+# that moment. For a window around it availability is served from a snapshot retaken every few seconds and
+# reservations are queued in arrival order, a few at a time, instead of every worker contending for the same rows.
+BOOKING_RELEASE_WINDOW_BEFORE = 5 * 60  # seconds before the rollover the window opens
+BOOKING_RELEASE_WINDOW_AFTER = 30 * 60  # seconds after the rollover the window closes
+BOOKING_RELEASE_SNAPSHOT_SECONDS = 5  # how stale the availability calendar may be during the window
+BOOKING_RELEASE_QUEUE_CONCURRENCY = 2  # reservations processed at once during the window
+BOOKING_RELEASE_QUEUE_TIMEOUT = 20  # seconds a queued member keeps their place without asking again
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -199,6 +239,9 @@ AUTH_USER_MODEL = 'users.MemberAccount'
 # Email Settings
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL')
 BOOKING_FROM_EMAIL = os.getenv('BOOKING_FROM_EMAIL')
+# Booking emails are queued in the OutboundEmail table and sent by the send-outbox command
+BOOKING_EMAIL_MAX_ATTEMPTS = 6
+BOOKING_EMAIL_RETRY_DELAY = 60  # seconds before the first retry, doubling after each failed attempt
 
 # OTP Email Settings
 OTP_EMAIL_SENDER = os.getenv('OTP_EMAIL_SENDER')